@@ -0,0 +1,63 @@
+"""
+Microbenchmarks for nosql_schema
+
+Usage: python benchmarks.py
+"""
+
+import timeit
+from nosql_schema import fields
+from nosql_schema.db.nosqlite import CollectionHandler
+
+
+def validate_uncompiled(field, value):
+    # validation as done before validators were compiled
+    valid = True
+
+    for validator in field.validators:
+        valid = valid and validator.validate(value=value, field=field)
+
+    return valid
+
+
+def benchmark_validation(number=100000):
+    cases = [
+        ('Field', fields.Field(), 'foo'),
+        ('NumberField', fields.NumberField(), 42),
+        ('NumberField(min, max)', fields.NumberField(min=0, max=100), 42),
+        ('StringField', fields.StringField(), 'John Doe'),
+        ('StringField(min, max)', fields.StringField(min=2, max=50), 'John Doe'),
+        ('EmailField', fields.EmailField(), 'john.doe@example.com'),
+        ('ChoiceField', fields.ChoiceField(choices=['foo', 'bar']), 'bar'),
+        ('DictField', fields.DictField(), {'foo': 'bar'}),
+        ('ListField', fields.ListField(), ['foo', 'bar']),
+    ]
+
+    print('Validations per second ({0} runs)'.format(number))
+    print('{0:<24}{1:>14}{2:>14}'.format('field', 'uncompiled', 'compiled'))
+
+    for name, field, value in cases:
+        uncompiled = timeit.timeit(lambda: validate_uncompiled(field, value), number=number)
+        compiled = timeit.timeit(lambda: field.validate(value=value), number=number)
+        print('{0:<24}{1:>14.0f}{2:>14.0f}'.format(name, number / uncompiled, number / compiled))
+
+
+def benchmark_convert_ids(number=100000):
+    cases = [
+        ('no ids', {'name': 'John Doe', 'age': {'$gt': 18}}),
+        ('_id', {'_id': '42'}),
+        ('_id $in (100)', {'_id': {'$in': [str(i) for i in range(100)]}}),
+        ('other $in (100)', {'name': {'$in': ['name %d' % i for i in range(100)]}}),
+        ('$or', {'$or': [{'_id': '42'}, {'name': 'John Doe'}]}),
+    ]
+
+    print('Conversions per second ({0} runs)'.format(number))
+    print('{0:<24}{1:>14}'.format('query', 'compiled'))
+
+    for name, query in cases:
+        seconds = timeit.timeit(lambda: CollectionHandler.convert_ids(query), number=number)
+        print('{0:<24}{1:>14.0f}'.format(name, number / seconds))
+
+
+if __name__ == '__main__':
+    benchmark_validation()
+    benchmark_convert_ids()
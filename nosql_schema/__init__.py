@@ -1,3 +1,4 @@
-from .schema import Schema
+from .schema import Schema, ensure_all_indexes
 from .db import create_handler
-from .helper import SchemaId
\ No newline at end of file
+from .helper import SchemaId, BulkResult, Page
+from .session import Session
@@ -0,0 +1,138 @@
+"""
+This module contains the asyncio API, see AsyncSchema (Python 3.5+ only)
+"""
+
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from .schema import Schema
+
+# nosqlite writes are serialized by SQLite anyway, one worker per database file avoids lock contention
+NOSQLITE_WORKERS = 1
+DEFAULT_WORKERS = 8
+
+# executor per database: {key: ThreadPoolExecutor}
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(handler):
+    """
+    Get the executor that runs the blocking calls for a DatabaseHandler.
+    nosqlite databases get a dedicated single thread per path, other databases share one executor.
+
+    :param handler: DatabaseHandler
+    :return: ThreadPoolExecutor
+    """
+    path = getattr(handler, 'path', None)
+    if path is not None:
+        key, workers = ('nosqlite', path), NOSQLITE_WORKERS
+    else:
+        key, workers = ('default',), DEFAULT_WORKERS
+
+    with _lock:
+        executor = _executors.get(key)
+        if executor is None:
+            executor = _executors[key] = ThreadPoolExecutor(max_workers=workers)
+
+    return executor
+
+
+def shutdown(wait=True):
+    """
+    Shut down all executors, e.g. when the event loop is closed
+
+    :param wait: Wait for pending calls
+    """
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+class AsyncIterator:
+    """
+    Async iterator over a blocking iterator, items are fetched in chunks of batch_size on the executor
+    """
+
+    def __init__(self, iterator, executor, batch_size=100):
+        self._iterator = iterator
+        self._executor = executor
+        self._batch_size = batch_size
+        self._buffer = deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer:
+            loop = asyncio.get_event_loop()
+            self._buffer = await loop.run_in_executor(self._executor, self._fetch)
+            if not self._buffer:
+                raise StopAsyncIteration
+
+        return self._buffer.popleft()
+
+    def _fetch(self):
+        return deque(islice(self._iterator, self._batch_size))
+
+
+class AsyncSchema(Schema):
+    """
+    Schema with coroutines for the blocking methods.
+    Calls run the regular Schema methods (including validation, post-processing and hooks) on an executor,
+    see get_executor. A Session of the calling thread does not apply to these calls.
+    """
+
+    @classmethod
+    def _run(cls, func, *args, **kwargs):
+        """
+        Run a blocking call on the executor of this class
+
+        :return: Future
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(get_executor(cls.get_handler()), partial(func, *args, **kwargs))
+
+    async def asave(self):
+        return await self._run(self.save)
+
+    async def adelete(self):
+        return await self._run(self.delete)
+
+    @classmethod
+    async def afind(cls, *args, **kwargs):
+        return await cls._run(cls.find, *args, **kwargs)
+
+    @classmethod
+    async def afind_one(cls, *args, **kwargs):
+        return await cls._run(cls.find_one, *args, **kwargs)
+
+    @classmethod
+    async def aget_many(cls, ids, **kwargs):
+        return await cls._run(cls.get_many, ids, **kwargs)
+
+    @classmethod
+    async def acount(cls, query=None):
+        return await cls._run(cls.count, query)
+
+    @classmethod
+    async def asave_all(cls, instances, batch_size=1000):
+        return await cls._run(cls.save_all, instances, batch_size)
+
+    @classmethod
+    def aiter_find(cls, query=None, batch_size=100, **kwargs):
+        """
+        Iterate over all matching objects: async for obj in Model.aiter_find(...)
+
+        :param query: Query to match with
+        :param batch_size: Number of objects to fetch per executor call
+        :return: AsyncIterator of objects, see iter_find for further parameters
+        """
+        iterator = cls.iter_find(query, batch_size=batch_size, **kwargs)
+        return AsyncIterator(iterator, get_executor(cls.get_handler()), batch_size)
@@ -0,0 +1,123 @@
+"""
+This module contains the query cache, see Schema.__cache__
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from .helper import SchemaId
+
+
+class QueryCache:
+    """
+    Query Cache
+    LRU cache with optional time to live for query results.
+    """
+
+    def __init__(self, size=128, ttl=None):
+        """
+        Initialize QueryCache
+
+        :param size: Maximum number of cached results
+        :param ttl: optional time to live of results in seconds
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # incremented by clear, results read before a clear are not cached
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached result
+
+        :param key: Key, see make_key
+        :return: tuple of (found, result)
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                # move to the end -> most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return True, entry[1]
+
+            self.misses += 1
+            return False, None
+
+    def set(self, key, result, generation=None):
+        """
+        Cache a result
+
+        :param key: Key, see make_key
+        :param result: Result to cache
+        :param generation: optional generation read before the query, the result is dropped if the cache
+                           has been cleared since
+        """
+        expires = time.time() + self.ttl if self.ttl else None
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, result)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all cached results
+        """
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        :return: Dictionary with hits, misses, evictions and entries
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+            }
+
+
+def make_key(*args):
+    """
+    Build a cache key from query arguments, independent of the order of dictionary keys
+
+    :return: Key, None if an argument has no stable encoding (the result must not be cached then)
+    """
+    try:
+        return json.dumps(args, sort_keys=True, default=_encode)
+    except TypeError:
+        return None
+
+
+def _encode(value):
+    """
+    Encode values JSON does not know for make_key
+    """
+    if isinstance(value, SchemaId):
+        return {'$schema_id': value.id_list if value.is_list else value.id_}
+
+    # e.g. ObjectId('...') or datetime, but not <object at 0x...>, addresses are reused by other objects
+    encoded = repr(value)
+    if ' at 0x' in encoded:
+        raise TypeError('{0} has no stable encoding'.format(encoded))
+
+    return {'$repr': encoded}
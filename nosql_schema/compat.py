@@ -0,0 +1,12 @@
+"""
+This module contains the differences between Python 2 and Python 3
+"""
+
+try:
+    integer_types = (int, long)
+    string_types = (str, unicode)
+    text_type = unicode
+except NameError:
+    integer_types = (int,)
+    string_types = (str,)
+    text_type = str
@@ -1,4 +1,7 @@
+import json
 from abc import ABCMeta, abstractmethod
+from ..helper import BulkResult
+from .query import get_value, DESCENDING
 
 
 class AbstractCollectionHandler():
@@ -9,23 +12,45 @@ class AbstractCollectionHandler():
     """
     __metaclass__ = ABCMeta
 
+    # find sorts by order_by in the database, otherwise Schema.find sorts the results in Python
+    native_sort = False
+
     def __init__(self):
         pass
 
     @abstractmethod
-    def find(self, query=None, limit=None, offset=0, order_by=None, reverse=False):
+    def find(self, query=None, limit=None, offset=0, order_by=None, reverse=False, projection=None):
         """
         Find all matching documents in database.
 
         :param query: Query to match with
         :param limit: Limit of documents to retrieve
         :param offset: Offset
-        :param order_by: Field to order results by
+        :param order_by: Field(s) to order results by, see query.normalize_sort
         :param reverse: Reverse ordering
+        :param projection: Fields to retrieve, see query.normalize_projection
         :return: List of documents
         """
         pass
 
+    def iter_find(self, query=None, limit=None, offset=0, order_by=None, reverse=False, batch_size=100,
+                  projection=None):
+        """
+        Iterate over all matching documents in database.
+        Backends should override this to fetch documents in chunks.
+
+        :param query: Query to match with
+        :param limit: Limit of documents to retrieve
+        :param offset: Offset
+        :param order_by: Field(s) to order results by, see query.normalize_sort
+        :param reverse: Reverse ordering
+        :param batch_size: Number of documents to fetch at once
+        :param projection: Fields to retrieve, see query.normalize_projection
+        :return: Generator of documents
+        """
+        for document in self.find(query, limit, offset, order_by, reverse, projection):
+            yield document
+
     @abstractmethod
     def delete(self, query):
         """
@@ -36,6 +61,22 @@ class AbstractCollectionHandler():
         """
         pass
 
+    def delete_many(self, query=None):
+        """
+        Delete all matching documents from database.
+        Backends should override this with a server-side delete.
+
+        :param query: Query to match with
+        :return: Number of deleted documents
+        """
+        count = 0
+
+        for document in self.find(query):
+            if self.delete({'_id': document['_id']}):
+                count += 1
+
+        return count
+
     @abstractmethod
     def update(self, document):
         """
@@ -46,6 +87,58 @@ class AbstractCollectionHandler():
         """
         pass
 
+    def update_fields(self, document_id, values):
+        """
+        Updates single fields of a document in database.
+        Backends should override this with a partial update.
+
+        :param document_id: _id of the document
+        :param values: Dictionary of fields to set
+        :return: True on success, else False
+        """
+        documents = self.find({'_id': document_id}, limit=1)
+        if not documents:
+            return False
+
+        document = documents[0]
+        document.update(values)
+
+        self.update(document)
+        return True
+
+    def update_fields_many(self, updates):
+        """
+        Updates single fields of many documents in database, see update_fields.
+        Backends should override this with a batched write.
+
+        :param updates: List of (_id, dictionary of fields to set) tuples
+        :return: Number of updated documents
+        """
+        return sum(1 for document_id, values in updates if self.update_fields(document_id, values))
+
+    def update_many(self, query, update):
+        """
+        Updates all matching documents in database.
+        Backends should override this with a server-side update.
+
+        :param query: Query to match with
+        :param update: Dictionary of update operators ($set, $unset, $inc)
+        :return: Number of updated documents
+        """
+        count = 0
+
+        for document in self.find(query):
+            document.update(update.get('$set') or {})
+            for key in update.get('$unset') or []:
+                document.pop(key, None)
+            for key, value in (update.get('$inc') or {}).items():
+                document[key] = (document.get(key) or 0) + value
+
+            self.update(document)
+            count += 1
+
+        return count
+
     @abstractmethod
     def insert(self, document):
         """
@@ -56,13 +149,32 @@ class AbstractCollectionHandler():
         """
         pass
 
+    def insert_many(self, documents):
+        """
+        Inserts the given documents in database.
+        Backends should override this with a batched write.
+
+        :param documents: List of dictionaries
+        :return: BulkResult
+        """
+        result = BulkResult(len(documents))
+
+        for index, document in enumerate(documents):
+            try:
+                result.ids[index] = self.insert(document)['_id']
+            except Exception as e:
+                result.errors[index] = e
+
+        return result
+
     @abstractmethod
-    def distinct(self, key):
+    def distinct(self, key, query=None):
         """
         Get all distinct values for the given key
 
         :param key: Key to look up
-        :return: Set of distinct values
+        :param query: optional query to match with
+        :return: List of distinct values
         """
         pass
 
@@ -76,13 +188,65 @@ class AbstractCollectionHandler():
         """
         pass
 
+    def aggregate(self, query=None, group_by=None, aggregates=None, sort=None, limit=None):
+        """
+        Aggregate all matching documents per group.
+        Backends should override this to aggregate in the database.
+
+        :param query: Query to match with
+        :param group_by: List of keys to group by, all documents form one group if empty
+        :param aggregates: List of (result name, function, key) tuples, see query.normalize_aggregates
+        :param sort: List of (result name, direction) tuples, see query.normalize_sort
+        :param limit: Limit of rows
+        :return: List of dictionaries with the group keys and results
+        """
+        group_by = group_by or []
+        aggregates = aggregates or []
+        groups = {}
+        rows = []
+
+        for document in self.iter_find(query):
+            group = [get_value(document, key) for key in group_by]
+            group_key = json.dumps(group, sort_keys=True, default=repr)
+
+            state = groups.get(group_key)
+            if state is None:
+                state = groups[group_key] = [[] for _ in aggregates]
+                row = dict(zip(group_by, group))
+                rows.append((row, state))
+
+            for values, (name, function, key) in zip(state, aggregates):
+                value = 1 if function == 'count' else get_value(document, key)
+                if value is not None:
+                    values.append(value)
+
+        result = []
+        for row, state in rows:
+            for values, (name, function, key) in zip(state, aggregates):
+                if function in ('sum', 'count'):
+                    row[name] = sum(values)
+                elif not values:
+                    row[name] = None
+                elif function == 'avg':
+                    row[name] = float(sum(values)) / len(values)
+                else:
+                    row[name] = min(values) if function == 'min' else max(values)
+            result.append(row)
+
+        # stable sorts, last key first
+        for key, direction in reversed(sort or []):
+            result.sort(key=lambda r: r.get(key), reverse=direction == DESCENDING)
+
+        return result[:limit] if limit else result
+
     @abstractmethod
     def create_index(self, keys, **kwargs):
         """
         Creates an index on collection
 
-        :param keys: list of keys
-        :param kwargs: further arguments
+        :param keys: key, list of keys or list of (key, direction) tuples
+        :param kwargs: further arguments, e.g. unique and name
+        :return: index name
         """
         pass
 
@@ -93,3 +257,19 @@ class AbstractCollectionHandler():
         :param name: index name
         """
         pass
+
+    def list_indexes(self):
+        """
+        Lists the indexes on collection
+
+        :return: List of index names
+        """
+        return []
+
+    def index_information(self):
+        """
+        Describes the indexes on collection
+
+        :return: Dictionary of index name -> {'keys': list of (key, direction) tuples, 'unique': bool}
+        """
+        return {}
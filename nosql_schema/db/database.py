@@ -9,9 +9,11 @@ def create_handler(*args, **kwargs):
 
     :param database: The name of the database to use, defaults to 'nosqlite'
     :param path: optional database path - for databases: 'nosqlite'
+    :param pool_size: optional number of pooled connections - for databases: 'nosqlite'
     :param host: optional database host - for databases: 'mongodb'
     :param port: optional database port - for databases: 'mongodb'
     :param name: optional database name - for databases: 'mongodb'
+    :param max_pool_size, min_pool_size, connect_timeout_ms, ...: optional client options - for databases: 'mongodb'
     :return: DatabaseHandler
     """
     database = kwargs.pop('database', 'nosqlite')
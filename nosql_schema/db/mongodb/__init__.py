@@ -1,2 +1,3 @@
 from .collection_handler import CollectionHandler
-from .database_handler import DatabaseHandler
\ No newline at end of file
+from .database_handler import DatabaseHandler
+from .client_registry import get_client, shutdown, reset_after_fork
@@ -0,0 +1,80 @@
+"""
+This module contains the process-wide MongoClient registry
+"""
+
+import os
+import threading
+from pymongo import MongoClient
+
+# configuration keys mapped to MongoClient keyword arguments
+CLIENT_OPTIONS = {
+    'max_pool_size': 'maxPoolSize',
+    'min_pool_size': 'minPoolSize',
+    'max_idle_time_ms': 'maxIdleTimeMS',
+    'wait_queue_timeout_ms': 'waitQueueTimeoutMS',
+    'connect_timeout_ms': 'connectTimeoutMS',
+    'socket_timeout_ms': 'socketTimeoutMS',
+    'server_selection_timeout_ms': 'serverSelectionTimeoutMS',
+}
+
+_clients = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def get_client(host, port, **options):
+    """
+    Get the shared MongoClient for host, port and options, create it if necessary
+
+    :param host: database host
+    :param port: database port
+    :param options: MongoClient options, see CLIENT_OPTIONS for configuration aliases
+    :return: MongoClient
+    """
+    options = dict((CLIENT_OPTIONS.get(k, k), v) for k, v in options.items())
+    key = (host, str(port), tuple(sorted(options.items())))
+
+    with _lock:
+        _check_pid()
+
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = MongoClient("mongodb://%s:%s" % (host, port), **options)
+
+        return client
+
+
+def shutdown():
+    """
+    Close all registered clients
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    for client in clients:
+        client.close()
+
+
+def reset_after_fork():
+    """
+    Forget all clients inherited from the parent process.
+    MongoClient instances must not be shared across a fork, call this in the child process.
+    The clients are not closed as they still belong to the parent.
+    """
+    global _pid
+
+    with _lock:
+        _clients.clear()
+        _pid = os.getpid()
+
+
+def _check_pid():
+    """
+    Drop inherited clients if the process has been forked (lock must be held)
+    """
+    global _pid
+
+    if _pid != os.getpid():
+        _clients.clear()
+        _pid = os.getpid()
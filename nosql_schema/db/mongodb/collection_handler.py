@@ -1,7 +1,11 @@
 from ...db import AbstractCollectionHandler
-from ...helper import SchemaId
+from ..query import normalize_sort, normalize_index, convert_query
+from ...helper import BulkResult
+from ...compat import string_types
 from bson.objectid import ObjectId
-from pymongo import ASCENDING, DESCENDING
+from bson.son import SON
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 
 class CollectionHandler(AbstractCollectionHandler):
@@ -9,41 +13,65 @@ class CollectionHandler(AbstractCollectionHandler):
     Collection Handler
     Class for collection handling (CRUD methods etc.).
     """
+    native_sort = True
+
     def __init__(self, collection_handle):
         self.collection_handle = collection_handle
 
-    def find(self, query=None, limit=None, offset=0, order_by=None, reverse=False):
+    def find(self, query=None, limit=None, offset=0, order_by=None, reverse=False, projection=None):
         """
         Find all matching documents in database.
 
         :param query: Query to match with
         :param limit: Limit of documents to retrieve
         :param offset: Offset
-        :param order_by: Field to order results by
+        :param order_by: Field(s) to order results by, see query.normalize_sort
         :param reverse: Reverse ordering
+        :param projection: Fields to retrieve, see query.normalize_projection
         :return: List of documents
         """
-        if limit is None:
-            limit = 0
+        result = self._cursor(query, limit, offset, order_by, reverse, projection)
 
-        if order_by is None:
-            order_by = '_id'
+        documents = []
+        for document in result:
+            document['_id'] = str(document['_id'])
+            documents.append(document)
 
-        if reverse:
-            reverse = DESCENDING
-        else:
-            reverse = ASCENDING
+        return documents
 
-        query = CollectionHandler.convert_ids(query)
+    def iter_find(self, query=None, limit=None, offset=0, order_by=None, reverse=False, batch_size=100,
+                  projection=None):
+        """
+        Iterate over all matching documents in database.
+        Documents are fetched from the cursor in chunks of batch_size.
 
-        result = self.collection_handle.find(filter=query, limit=limit).sort(order_by, reverse).skip(offset)
+        :param query: Query to match with
+        :param limit: Limit of documents to retrieve
+        :param offset: Offset
+        :param order_by: Field(s) to order results by, see query.normalize_sort
+        :param reverse: Reverse ordering
+        :param batch_size: Number of documents to fetch at once
+        :param projection: Fields to retrieve, see query.normalize_projection
+        :return: Generator of documents
+        """
+        result = self._cursor(query, limit, offset, order_by, reverse, projection).batch_size(batch_size)
 
-        documents = []
         for document in result:
             document['_id'] = str(document['_id'])
-            documents.append(document)
+            yield document
 
-        return documents
+    def _cursor(self, query, limit, offset, order_by, reverse, projection=None):
+        """
+        Build the cursor for find and iter_find.
+        Sort, skip and limit are sent with the query, documents are only sorted if asked for.
+
+        :return: pymongo Cursor
+        """
+        query = CollectionHandler.convert_ids(query)
+        sort = normalize_sort(order_by, reverse)
+
+        return self.collection_handle.find(filter=query, projection=projection, sort=sort or None,
+                                           skip=offset or 0, limit=limit or 0)
 
     def delete(self, query):
         """
@@ -59,6 +87,18 @@ class CollectionHandler(AbstractCollectionHandler):
             return True
         return False
 
+    def delete_many(self, query=None):
+        """
+        Delete all matching documents from database.
+
+        :param query: Query to match with
+        :return: Number of deleted documents
+        """
+        query = CollectionHandler.convert_ids(query) or {}
+
+        result = self.collection_handle.delete_many(query)
+        return result.deleted_count
+
     def update(self, document):
         """
         Updates the given document in database.
@@ -75,6 +115,55 @@ class CollectionHandler(AbstractCollectionHandler):
                 return document
         return None
 
+    def update_fields(self, document_id, values):
+        """
+        Updates single fields of a document in database with $set.
+
+        :param document_id: _id of the document
+        :param values: Dictionary of fields to set
+        :return: True on success, else False
+        """
+        if not values:
+            return True
+
+        query = CollectionHandler.convert_ids({'_id': document_id})
+        result = self.collection_handle.update_one(query, {'$set': values})
+        return result.matched_count == 1
+
+    def update_fields_many(self, updates):
+        """
+        Updates single fields of many documents in database with one unordered bulk write of $set operations.
+
+        :param updates: List of (_id, dictionary of fields to set) tuples
+        :return: Number of updated documents
+        """
+        requests = [UpdateOne(CollectionHandler.convert_ids({'_id': document_id}), {'$set': values})
+                    for document_id, values in updates if values]
+        if not requests:
+            return 0
+
+        result = self.collection_handle.bulk_write(requests, ordered=False)
+        return result.matched_count
+
+    def update_many(self, query, update):
+        """
+        Updates all matching documents in database.
+
+        :param query: Query to match with
+        :param update: Dictionary of update operators ($set, $unset, $inc)
+        :return: Number of matched documents, like the other backends (documents may be unchanged)
+        """
+        update = dict((operator, fields) for operator, fields in update.items() if fields)
+        if not update:
+            return 0
+
+        if '$unset' in update:
+            update['$unset'] = dict((key, '') for key in update['$unset'])
+
+        query = CollectionHandler.convert_ids(query)
+        result = self.collection_handle.update_many(query, update)
+        return result.matched_count
+
     def insert(self, document):
         """
         Inserts the given document in database.
@@ -88,14 +177,42 @@ class CollectionHandler(AbstractCollectionHandler):
             return document
         return None
 
-    def distinct(self, key):
+    def insert_many(self, documents):
+        """
+        Inserts the given documents in database with one unordered bulk write.
+
+        :param documents: List of dictionaries
+        :return: BulkResult
+        """
+        result = BulkResult(len(documents))
+
+        if not documents:
+            return result
+
+        try:
+            self.collection_handle.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                result.errors[error['index']] = error.get('errmsg')
+
+        # insert_many assigns the ObjectIds to the documents
+        for index, document in enumerate(documents):
+            if index not in result.errors:
+                document['_id'] = str(document['_id'])
+                result.ids[index] = document['_id']
+
+        return result
+
+    def distinct(self, key, query=None):
         """
         Get all distinct values for the given key
 
         :param key: Key to look up
-        :return: Set of distinct values
+        :param query: optional query to match with
+        :return: List of distinct values
         """
-        return self.collection_handle.distinct(key)
+        query = CollectionHandler.convert_ids(query)
+        return self.collection_handle.distinct(key, query)
 
     def count(self, query=None):
         """
@@ -107,14 +224,60 @@ class CollectionHandler(AbstractCollectionHandler):
         query = CollectionHandler.convert_ids(query)
         return self.collection_handle.count(query)
 
+    def aggregate(self, query=None, group_by=None, aggregates=None, sort=None, limit=None):
+        """
+        Aggregate all matching documents per group with an aggregation pipeline
+
+        :param query: Query to match with
+        :param group_by: List of keys to group by, all documents form one group if empty
+        :param aggregates: List of (result name, function, key) tuples, see query.normalize_aggregates
+        :param sort: List of (result name, direction) tuples, see query.normalize_sort
+        :param limit: Limit of rows
+        :return: List of dictionaries with the group keys and results
+        """
+        group_by = group_by or []
+        aggregates = aggregates or []
+
+        # result names may contain dots, which are not allowed as field names in $group
+        fields = {}
+        group = {'_id': None}
+        if group_by:
+            group['_id'] = dict(('k%d' % index, '$' + key) for index, key in enumerate(group_by))
+            fields.update((key, '_id.k%d' % index) for index, key in enumerate(group_by))
+
+        for index, (name, function, key) in enumerate(aggregates):
+            group['a%d' % index] = {'$sum': 1} if function == 'count' else {'$' + function: '$' + key}
+            fields[name] = 'a%d' % index
+
+        pipeline = []
+        if query:
+            pipeline.append({'$match': CollectionHandler.convert_ids(query)})
+        pipeline.append({'$group': group})
+        if sort:
+            pipeline.append({'$sort': SON((fields[key], direction) for key, direction in sort)})
+        if limit:
+            pipeline.append({'$limit': limit})
+
+        rows = []
+        for document in self.collection_handle.aggregate(pipeline):
+            row = {}
+            for index, key in enumerate(group_by):
+                row[key] = (document['_id'] or {}).get('k%d' % index)
+            for index, (name, function, key) in enumerate(aggregates):
+                row[name] = document['a%d' % index]
+            rows.append(row)
+
+        return rows
+
     def create_index(self, keys, **kwargs):
         """
         Creates an index on collection
 
-        :param keys: list of keys
-        :param kwargs: further arguments
+        :param keys: key, list of keys or list of (key, direction) tuples
+        :param kwargs: further arguments, e.g. unique and name
+        :return: index name
         """
-        self.collection_handle.create_index(keys, **kwargs)
+        return self.collection_handle.create_index(normalize_index(keys), **kwargs)
 
     def drop_index(self, name):
         """
@@ -124,40 +287,51 @@ class CollectionHandler(AbstractCollectionHandler):
         """
         self.collection_handle.drop_index(name)
 
+    def list_indexes(self):
+        """
+        Lists the indexes on collection
+
+        :return: List of index names
+        """
+        return list(self.collection_handle.index_information().keys())
+
+    def index_information(self):
+        """
+        Describes the indexes on collection
+
+        :return: Dictionary of index name -> {'keys': list of (key, direction) tuples, 'unique': bool}
+        """
+        information = {}
+        for name, info in self.collection_handle.index_information().items():
+            keys = []
+            for key, direction in info['key']:
+                if key == '_fts':
+                    # text indexes are stored as _fts / _ftsx with the fields as weights
+                    keys.extend((field, 'text') for field in sorted(info.get('weights', {})))
+                elif key != '_ftsx':
+                    keys.append((key, direction))
+            information[name] = {'keys': keys, 'unique': bool(info.get('unique'))}
+
+        return information
+
     @staticmethod
-    def convert_ids(query, is_id=False):
+    def convert_ids(query):
         """
-        Casts all '_id' to 'ObjectId'
+        Casts all '_id' to 'ObjectId', see query.convert_query
 
         :param query: Query that has to be transformed
-        :param is_id: Indicates that the current part derived from an '_id'
         :return: Transformed query (dict)
         """
-        if not isinstance(query, dict):
-            return query
-
-        new_query = query.copy()
-
-        for k,v in new_query.iteritems():
-            if isinstance(v, SchemaId):
-                if v.is_list:
-                    new_query[k] = [ObjectId(unicode(id_)) for id_ in v.id_list]
-                else:
-                    new_query[k] = ObjectId(unicode(v.id_))
-            elif k == '_id':
-                if isinstance(v, dict):
-                    new_query[k] = CollectionHandler.convert_ids(v, True)
-                elif type(v) in [str, unicode]:
-                    new_query[k] = ObjectId(unicode(v))
-            elif is_id:
-                if type(v) in [str, unicode]:
-                    new_query[k] = ObjectId(unicode(v))
-                elif type(v) == list:
-                    new_query[k] = [ObjectId(unicode(id_)) for id_ in v]
-            elif isinstance(v, dict):
-                new_query[k] = CollectionHandler.convert_ids(v)
-            elif isinstance(v, list):
-                new_list = [CollectionHandler.convert_ids(x) for x in v]
-                new_query[k] = new_list
-
-        return new_query
+        return convert_query(query, convert_id)
+
+
+def convert_id(value):
+    """
+    Cast an id to 'ObjectId'
+
+    :param value: id
+    :return: id
+    """
+    if isinstance(value, string_types):
+        return ObjectId(value)
+    return value
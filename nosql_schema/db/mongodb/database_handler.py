@@ -1,6 +1,6 @@
 from ...db import AbstractDatabaseHandler
 from .collection_handler import CollectionHandler
-from pymongo import MongoClient
+from .client_registry import get_client
 
 
 class DatabaseHandler(AbstractDatabaseHandler):
@@ -9,26 +9,34 @@ class DatabaseHandler(AbstractDatabaseHandler):
     Handling MongoDB.
     """
 
-    def __init__(self, host='localhost', port='27017', name='test'):
+    def __init__(self, host='localhost', port='27017', name='test', **options):
+        """
+        Initialize DatabaseHandler
+        :param host: Database host
+        :param port: Database port
+        :param name: Database name
+        :param options: MongoClient options like pool sizes and timeouts, see client_registry.CLIENT_OPTIONS
+        """
         self.host = host
         self.port = port
         self.database_name = name
+        self.options = options
         self.client = None
 
     def connect(self):
         """
         Connect to a database.
+        Uses the process-wide client for host, port and options, it is looked up on every call
+        so clients replaced by client_registry.shutdown or after a fork are picked up.
         """
-        if self.client is None:
-            self.client = MongoClient("mongodb://%s:%s" % (self.host, self.port))
+        self.client = get_client(self.host, self.port, **self.options)
 
     def close(self):
         """
         Terminate the connection to the database
+        The shared client stays open, see client_registry.shutdown
         """
-        # Garbage collection will handle it
-        del self.client
-        self.client = None
+        pass
 
     def drop_collection(self, collection_name):
         """
@@ -1,2 +1,3 @@
 from .collection_handler import CollectionHandler
-from .database_handler import DatabaseHandler
\ No newline at end of file
+from .database_handler import DatabaseHandler
+from .connection_pool import ConnectionPool, get_pool, close_all
@@ -1,5 +1,12 @@
+import json
+import sqlite3
 from ...db import AbstractCollectionHandler
-from ...helper import SchemaId
+from ...helper import BulkResult
+from ...compat import string_types
+from .sql import data_expression, patch_expression, order_clause, limit_clause, match_clause, where_clause, \
+    distinct_expression, decode_value, aggregate_clauses, \
+    index_statement, index_identifier, index_keys, INDEX_SEPARATOR
+from ..query import index_name, convert_query
 
 
 class CollectionHandler(AbstractCollectionHandler):
@@ -7,36 +14,91 @@ class CollectionHandler(AbstractCollectionHandler):
     Collection Handler
     Class for collection handling (CRUD methods etc.).
     """
+    native_sort = True
+
     def __init__(self, collection_handle):
         self.collection_handle = collection_handle
 
-    def find(self, query=None, limit=None, offset=0, order_by=None, reverse=False):
+    def find(self, query=None, limit=None, offset=0, order_by=None, reverse=False, projection=None):
         """
         Find all matching documents in database.
 
         :param query: Query to match with
         :param limit: Limit of documents to retrieve
         :param offset: Offset
-        :param order_by: Field to order results by
+        :param order_by: Field(s) to order results by, see query.normalize_sort
         :param reverse: Reverse ordering
+        :param projection: Fields to retrieve, see query.normalize_projection
         :return: List of documents
         """
+        sql, params = self._select(query, limit, offset, order_by, reverse, projection)
+        collection = self.collection_handle
+
+        return [collection._load(*row) for row in collection.db.execute(sql, params)]
+
+    def iter_find(self, query=None, limit=None, offset=0, order_by=None, reverse=False, batch_size=100,
+                  projection=None):
+        """
+        Iterate over all matching documents in database.
+        Rows are fetched and decoded in chunks of batch_size.
+
+        :param query: Query to match with
+        :param limit: Limit of documents to retrieve
+        :param offset: Offset
+        :param order_by: Field(s) to order results by, see query.normalize_sort
+        :param reverse: Reverse ordering
+        :param batch_size: Number of documents to fetch at once
+        :param projection: Fields to retrieve, see query.normalize_projection
+        :return: Generator of documents
+        """
+        sql, params = self._select(query, limit, offset, order_by, reverse, projection)
+        collection = self.collection_handle
+        cursor = collection.db.execute(sql, params)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                yield collection._load(*row)
+
+    def _select(self, query, limit, offset, order_by, reverse, projection=None):
+        """
+        Build the SELECT statement for find and iter_find.
+        Filtering, ordering and paging all happen in SQLite.
+
+        :return: tuple of SQL and parameters
+        """
+        where, params = self._where(query)
+        limit_sql, limit_params = limit_clause(limit, offset)
+
+        sql = 'select id, %s from %s%s%s%s' % (data_expression(projection), self.collection_handle.name, where,
+                                               order_clause(order_by, reverse), limit_sql)
+
+        return sql, params + limit_params
+
+    def _where(self, query):
+        """
+        Build the WHERE clause for a query
+
+        :param query: Query to match with
+        :return: tuple of SQL and parameters
+        """
         query = CollectionHandler.convert_ids(query)
-        results = self.collection_handle.find(query, limit)[offset:]
 
-        if order_by is not None:
-            def deep_sort(d, order_key):
-                keys = order_key.split('.')
-                val = d
-                for key in keys:
-                    val = getattr(val, key)
-                    if val is None:
-                        return None
-                return val
+        if not query:
+            return '', []
+
+        # conditions are evaluated by SQLite (and use indexes), what can not be translated by match_clause
+        conditions, params, remaining = where_clause(query)
 
-            results = sorted(results, key=lambda d: deep_sort(d, order_by), reverse=reverse)
+        if remaining:
+            condition, match_params = match_clause(remaining)
+            conditions.append(condition)
+            params.extend(match_params)
 
-        return results
+        return ' where ' + ' and '.join(conditions), params
 
     def delete(self, query):
         """
@@ -48,6 +110,19 @@ class CollectionHandler(AbstractCollectionHandler):
         query = CollectionHandler.convert_ids(query)
         return self.collection_handle.delete(query)
 
+    def delete_many(self, query=None):
+        """
+        Delete all matching documents from database with one DELETE statement.
+
+        :param query: Query to match with
+        :return: Number of deleted documents
+        """
+        where, params = self._where(query)
+
+        collection = self.collection_handle
+        cursor = collection.db.execute('delete from %s%s' % (collection.name, where), params)
+        return cursor.rowcount
+
     def update(self, document):
         """
         Updates the given document in database.
@@ -55,9 +130,80 @@ class CollectionHandler(AbstractCollectionHandler):
         :param document: Dictionary with _id
         :return: document
         """
-        document = CollectionHandler.convert_ids(document)
+        if '_id' in document:
+            # only the id has to be converted, not the whole document
+            document = dict(document, _id=convert_id(document['_id']))
         return self.collection_handle.update(document)
 
+    def update_fields(self, document_id, values):
+        """
+        Updates single fields of a document in database with json_set.
+
+        :param document_id: _id of the document
+        :param values: Dictionary of fields to set
+        :return: True on success, else False
+        """
+        if not values:
+            return True
+
+        expression, params = patch_expression(values)
+        collection = self.collection_handle
+        cursor = collection.db.execute('update %s set data = %s where id = ?' % (collection.name, expression),
+                                       params + [int(document_id)])
+        return cursor.rowcount == 1
+
+    def update_fields_many(self, updates):
+        """
+        Updates single fields of many documents in database with json_set within one transaction.
+
+        :param updates: List of (_id, dictionary of fields to set) tuples
+        :return: Number of updated documents
+        """
+        updates = [(document_id, values) for document_id, values in updates if values]
+        if not updates:
+            return 0
+
+        collection = self.collection_handle
+        db = collection.db
+        count = 0
+
+        db.execute('begin immediate')
+        try:
+            for document_id, values in updates:
+                expression, params = patch_expression(values)
+                cursor = db.execute('update %s set data = %s where id = ?' % (collection.name, expression),
+                                    params + [int(document_id)])
+                count += cursor.rowcount
+            db.execute('commit')
+        except Exception:
+            db.execute('rollback')
+            raise
+
+        return count
+
+    def update_many(self, query, update):
+        """
+        Updates all matching documents in database with one UPDATE statement.
+
+        :param query: Query to match with
+        :param update: Dictionary of update operators ($set, $unset, $inc)
+        :return: Number of updated documents
+        """
+        values = update.get('$set')
+        unset = update.get('$unset')
+        increments = update.get('$inc')
+
+        if not values and not unset and not increments:
+            return 0
+
+        expression, params = patch_expression(values, list(unset or []), increments)
+        where, where_params = self._where(query)
+
+        collection = self.collection_handle
+        cursor = collection.db.execute('update %s set data = %s%s' % (collection.name, expression, where),
+                                       params + where_params)
+        return cursor.rowcount
+
     def insert(self, document):
         """
         Inserts the given document in database.
@@ -67,33 +213,180 @@ class CollectionHandler(AbstractCollectionHandler):
         """
         return self.collection_handle.insert(document)
 
-    def distinct(self, key):
+    def insert_many(self, documents):
+        """
+        Inserts the given documents in database within one transaction.
+        If a document violates a constraint (e.g. a unique index) only this document fails, see _insert_rows.
+
+        :param documents: List of dictionaries
+        :return: BulkResult
+        """
+        result = BulkResult(len(documents))
+        rows = []
+        indexes = []
+
+        for index, document in enumerate(documents):
+            try:
+                rows.append((json.dumps(document),))
+                indexes.append(index)
+            except (TypeError, ValueError) as e:
+                result.errors[index] = e
+
+        if not rows:
+            return result
+
+        db = self.collection_handle.db
+        table = self.collection_handle.name
+
+        db.execute('begin immediate')
+        try:
+            db.executemany('insert into %s(data) values (?)' % table, rows)
+            # ids of one statement are consecutive, the sequence holds the last one
+            last_id = db.execute('select seq from sqlite_sequence where name = ?', (table,)).fetchone()[0]
+            db.execute('commit')
+        except sqlite3.IntegrityError:
+            db.execute('rollback')
+            return self._insert_rows(rows, indexes, documents, result)
+        except Exception as e:
+            db.execute('rollback')
+            for index in indexes:
+                result.errors[index] = e
+            return result
+
+        first_id = last_id - len(rows) + 1
+        for offset, index in enumerate(indexes):
+            documents[index]['_id'] = first_id + offset
+            result.ids[index] = first_id + offset
+
+        return result
+
+    def _insert_rows(self, rows, indexes, documents, result):
+        """
+        Inserts the rows of insert_many one by one within one transaction, used if a row violates a constraint.
+        A failing statement only undoes itself, so the errors are reported per document like on MongoDB.
+
+        :param rows: List of (data,) tuples
+        :param indexes: Indexes of the rows in documents
+        :param documents: List of dictionaries
+        :param result: BulkResult
+        :return: BulkResult
         """
-        Get all distinct values for the given key
+        db = self.collection_handle.db
+        table = self.collection_handle.name
+        ids = {}
+
+        db.execute('begin immediate')
+        try:
+            for row, index in zip(rows, indexes):
+                try:
+                    ids[index] = db.execute('insert into %s(data) values (?)' % table, row).lastrowid
+                except sqlite3.IntegrityError as e:
+                    result.errors[index] = e
+            db.execute('commit')
+        except Exception as e:
+            db.execute('rollback')
+            for index in indexes:
+                result.errors[index] = e
+            return result
+
+        for index, document_id in ids.items():
+            documents[index]['_id'] = document_id
+            result.ids[index] = document_id
+
+        return result
+
+    def distinct(self, key, query=None):
+        """
+        Get all distinct values for the given key with one SELECT DISTINCT.
+        Documents without the key are left out, lists contribute their items (like MongoDB).
 
         :param key: Key to look up
-        :return: Set of distinct values
+        :param query: optional query to match with
+        :return: List of distinct values
         """
-        return self.collection_handle.distinct(key)
+        where, params = self._where(query)
+        expression = distinct_expression(key)
+        condition = '%s is not null' % expression[0]
+        where = where + ' and ' + condition if where else ' where ' + condition
+
+        collection = self.collection_handle
+        rows = collection.db.execute('select distinct %s, %s from %s%s' % (expression[0], expression[1],
+                                                                           collection.name, where), params)
+
+        # values may be dictionaries or lists, which are not hashable
+        values = []
+        seen = set()
+        for value_type, value in rows:
+            value = decode_value(value_type, value)
+            for item in (value if value_type == 'array' else [value]):
+                item_key = json.dumps(item, sort_keys=True)
+                if item_key not in seen:
+                    seen.add(item_key)
+                    values.append(item)
+
+        return values
 
     def count(self, query=None):
         """
-        Count all documents that match the query
+        Count all documents that match the query with one SELECT COUNT(*)
 
         :param query: Query to match with
         :return: Number of documents
         """
-        query = CollectionHandler.convert_ids(query)
-        return self.collection_handle.count(query)
+        where, params = self._where(query)
+
+        collection = self.collection_handle
+        return collection.db.execute('select count(*) from %s%s' % (collection.name, where), params).fetchone()[0]
+
+    def aggregate(self, query=None, group_by=None, aggregates=None, sort=None, limit=None):
+        """
+        Aggregate all matching documents per group with one SELECT ... GROUP BY
 
-    def create_index(self, keys, **kwargs):
+        :param query: Query to match with
+        :param group_by: List of keys to group by, all documents form one group if empty
+        :param aggregates: List of (result name, function, key) tuples, see query.normalize_aggregates
+        :param sort: List of (result name, direction) tuples, see query.normalize_sort
+        :param limit: Limit of rows
+        :return: List of dictionaries with the group keys and results
+        """
+        group_by = group_by or []
+        aggregates = aggregates or []
+
+        where, params = self._where(query)
+        columns, group, order = aggregate_clauses(group_by, aggregates, sort)
+        limit_sql, limit_params = limit_clause(limit)
+
+        collection = self.collection_handle
+        sql = 'select %s from %s%s%s%s%s' % (columns, collection.name, where, group, order, limit_sql)
+
+        rows = []
+        for values in collection.db.execute(sql, params + limit_params):
+            row = {}
+            for index, key in enumerate(group_by):
+                row[key] = decode_value(values[2 * index], values[2 * index + 1])
+            for index, (name, function, key) in enumerate(aggregates):
+                row[name] = values[2 * len(group_by) + index]
+            rows.append(row)
+
+        return rows
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
         """
-        Creates an index on collection
+        Creates an expression index on collection
 
-        :param keys: list of keys
-        :param kwargs: further arguments
+        :param keys: key, list of keys or list of (key, direction) tuples
+        :param unique: Create a unique index
+        :param name: optional index name, defaults to e.g. 'name_1'
+        :param kwargs: further arguments (ignored)
+        :return: index name
         """
-        raise NotImplementedError
+        if name is None:
+            name = index_name(keys)
+
+        collection = self.collection_handle
+        collection.db.execute(index_statement(collection.name, name, keys, unique))
+
+        return name
 
     def drop_index(self, name):
         """
@@ -101,42 +394,65 @@ class CollectionHandler(AbstractCollectionHandler):
 
         :param name: index name
         """
-        raise NotImplementedError
+        collection = self.collection_handle
+        collection.db.execute('drop index if exists %s' % index_identifier(collection.name, name))
+
+    def list_indexes(self):
+        """
+        Lists the indexes on collection
+
+        :return: List of index names
+        """
+        collection = self.collection_handle
+        prefix = collection.name + INDEX_SEPARATOR
+        rows = collection.db.execute("select name from sqlite_master where type = 'index' and tbl_name = ?",
+                                     (collection.name,))
+
+        # the primary key is the implicit index on _id
+        return ['_id_'] + [row[0][len(prefix):] for row in rows if row[0].startswith(prefix)]
+
+    def index_information(self):
+        """
+        Describes the indexes on collection
+
+        :return: Dictionary of index name -> {'keys': list of (key, direction) tuples, 'unique': bool}
+        """
+        collection = self.collection_handle
+        prefix = collection.name + INDEX_SEPARATOR
+        rows = collection.db.execute("select name, sql from sqlite_master where type = 'index' and tbl_name = ?",
+                                     (collection.name,))
+
+        information = {'_id_': {'keys': [('_id', 1)], 'unique': True}}
+        for name, statement in rows:
+            if name.startswith(prefix) and statement:
+                information[name[len(prefix):]] = {
+                    'keys': index_keys(statement),
+                    'unique': statement.upper().startswith('CREATE UNIQUE'),
+                }
+
+        return information
 
     @staticmethod
-    def convert_ids(query, is_id=False):
+    def convert_ids(query):
         """
-        Casts all '_id' to 'int'
+        Casts all '_id' to 'int', see query.convert_query
 
         :param query: Query that has to be transformed
-        :param is_id: Indicates that the current part derived from an '_id'
         :return: Transformed query (dict)
         """
         if not isinstance(query, dict):
             return {}
 
-        new_query = query.copy()
-
-        for k,v in new_query.iteritems():
-            if isinstance(v, SchemaId):
-                if v.is_list:
-                    new_query[k] = [int(id_) for id_ in v.id_list]
-                else:
-                    new_query[k] = int(v.id_)
-            elif k == '_id':
-                if isinstance(v, dict):
-                    new_query[k] = CollectionHandler.convert_ids(v, True)
-                elif type(v) in [str, unicode]:
-                    new_query[k] = int(v)
-            elif is_id:
-                if type(v) in [str, unicode]:
-                    new_query[k] = int(v)
-                elif type(v) == list:
-                    new_query[k] = [int(id_) for id_ in v]
-            elif isinstance(v, dict):
-                new_query[k] = CollectionHandler.convert_ids(v)
-            elif isinstance(v, list):
-                new_list = [CollectionHandler.convert_ids(x) for x in v]
-                new_query[k] = new_list
-
-        return new_query
+        return convert_query(query, convert_id)
+
+
+def convert_id(value):
+    """
+    Cast an id to 'int'
+
+    :param value: id
+    :return: id
+    """
+    if isinstance(value, string_types):
+        return int(value)
+    return value
@@ -0,0 +1,151 @@
+"""
+This module contains the process-wide nosqlite connection pool
+"""
+
+import threading
+from nosqlite import Connection
+from .sql import register_functions
+
+DEFAULT_POOL_SIZE = 5
+
+
+class ConnectionPool:
+    """
+    Connection Pool
+    Keeps idle nosqlite connections for one database path.
+    Connections are checked out per thread: nested checkouts in the same thread
+    share one connection, which is returned to the pool by the outermost release.
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE):
+        """
+        Initialize ConnectionPool
+
+        :param path: Path to the database or ':memory:'
+        :param size: Maximum number of idle connections to keep
+        """
+        self.path = path
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def acquire(self):
+        """
+        Check out a connection for the current thread
+
+        :return: nosqlite Connection
+        """
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+
+        if depth == 0:
+            connection = None
+            with self._lock:
+                if self._idle:
+                    connection = self._idle.pop()
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+            if connection is None:
+                # connections may be checked out by another thread later on
+                connection = Connection(self.path, check_same_thread=False)
+                register_functions(connection.db)
+
+            local.connection = connection
+
+        local.depth = depth + 1
+        return local.connection
+
+    def release(self):
+        """
+        Give back the current thread's connection
+        """
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+
+        if depth == 0:
+            return
+
+        local.depth = depth - 1
+        if local.depth > 0:
+            return
+
+        connection = local.connection
+        local.connection = None
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+
+        connection.close()
+
+    def current(self):
+        """
+        Get the connection checked out by the current thread
+
+        :return: nosqlite Connection or None
+        """
+        return getattr(self._local, 'connection', None)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for connection in idle:
+            connection.close()
+
+    def stats(self):
+        """
+        Get pool statistics
+
+        :return: Dictionary with hits, misses, idle and size
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'idle': len(self._idle),
+                'size': self.size,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, size=None):
+    """
+    Get the connection pool for the given path, create it if necessary
+
+    :param path: Path to the database or ':memory:'
+    :param size: optional maximum number of idle connections
+    :return: ConnectionPool
+    """
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path, DEFAULT_POOL_SIZE if size is None else size)
+        elif size is not None:
+            pool.size = size
+
+        return pool
+
+
+def close_all():
+    """
+    Close all idle connections of all pools
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    for pool in pools:
+        pool.close()
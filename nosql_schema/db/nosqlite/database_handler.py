@@ -1,6 +1,7 @@
 from ...db import AbstractDatabaseHandler
 from .collection_handler import CollectionHandler
-from nosqlite import Connection
+from .connection_pool import get_pool
+from nosqlite import Collection
 
 
 class DatabaseHandler(AbstractDatabaseHandler):
@@ -9,27 +10,36 @@ class DatabaseHandler(AbstractDatabaseHandler):
     Handling nosqlite database.
     """
 
-    def __init__(self, path=':memory:'):
+    def __init__(self, path=':memory:', pool_size=None):
         """
         Initialize DatabaseHandler
         :param path: Path to the database or ':memory:'
+        :param pool_size: optional maximum number of idle pooled connections for this path
         """
         self.path = path
-        self.connection = None
+        self.pool = get_pool(path, pool_size)
+
+    @property
+    def connection(self):
+        """
+        The connection checked out by the current thread
+        :return: nosqlite Connection or None
+        """
+        return self.pool.current()
 
     def connect(self):
         """
         Connect to a database.
+        Checks out a pooled connection for the current thread.
         """
-        self.close()
-        self.connection = Connection(self.path)
+        self.pool.acquire()
 
     def close(self):
         """
         Terminate the connection to the database
+        Gives the connection back to the pool.
         """
-        if self.connection is not None:
-            self.connection.close()
+        self.pool.release()
 
     def drop_collection(self, collection_name):
         """
@@ -48,9 +58,12 @@ class DatabaseHandler(AbstractDatabaseHandler):
         :return: Collection handle
         """
         collection = None
+        connection = self.connection
 
-        if self.connection:
-            collection = CollectionHandler(self.connection[collection_name])
+        if connection:
+            # pooled connections outlive a single `with` block, so don't rely on
+            # nosqlite's per-connection collection cache (the table may have been dropped)
+            collection = CollectionHandler(Collection(connection.db, collection_name))
 
         return collection
 
@@ -0,0 +1,438 @@
+"""
+This module contains the SQL building blocks for the nosqlite backend
+"""
+
+import json
+import re
+import warnings
+from nosqlite import Collection
+from ...compat import string_types, integer_types
+from ..query import normalize_sort, normalize_index, parse_query, Condition, Logical, ASCENDING, DESCENDING
+
+MATCH_FUNCTION = 'nosql_schema_match'
+INDEX_SEPARATOR = '__'
+SCALAR_TYPES = string_types + integer_types + (float, bool)
+COMPARISONS = {'$eq': '=', '$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+AGGREGATE_FUNCTIONS = {'sum': 'coalesce(sum(%s), 0)', 'avg': 'avg(%s)', 'min': 'min(%s)', 'max': 'max(%s)'}
+
+_key_part = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_index_column = re.compile(r"(?:json_extract\(data, '\$\.([^']*)'\)|\bid\b)( desc)?")
+
+# used to apply Mongo-style queries with nosqlite's own matching rules
+_matcher = Collection(None, '', create=False)
+_parsed_queries = {}
+
+
+def json_path(key):
+    """
+    Get the JSON path for a (dotted) document key
+
+    :param key: Key, e.g. 'author.name'
+    :return: JSON path, e.g. '$.author.name'
+    """
+    parts = []
+    for part in key.split('.'):
+        if _key_part.match(part) is None:
+            if '"' in part or "'" in part:
+                raise ValueError('Invalid key "{0}"'.format(key))
+            part = '"%s"' % part
+        parts.append(part)
+
+    return '$.' + '.'.join(parts)
+
+
+def field_expression(key):
+    """
+    Get the SQL expression for a (dotted) document key.
+    Expressions are written the same way everywhere, so they match expression indexes.
+
+    :param key: Key, e.g. 'author.name'
+    :return: SQL expression
+    """
+    if key == '_id':
+        return 'id'
+
+    return "json_extract(data, '%s')" % json_path(key)
+
+
+def data_expression(projection=None):
+    """
+    Get the SQL expression for the (projected) document
+
+    :param projection: Fields to retrieve, see query.normalize_projection
+    :return: SQL expression
+    """
+    if not projection:
+        return 'data'
+
+    if any(projection.values()):
+        # only the given fields
+        return 'json_object(%s)' % ', '.join("'%s', %s" % (key, field_expression(key))
+                                             for key in sorted(projection))
+
+    # all but the given fields
+    return 'json_remove(data, %s)' % ', '.join("'%s'" % json_path(key) for key in sorted(projection))
+
+
+def distinct_expression(key):
+    """
+    Get the SQL expressions for the JSON type and the value of a (dotted) document key, see decode_value
+
+    :param key: Key, e.g. 'author.name'
+    :return: tuple of SQL expressions for type and value, type is null if the key is missing
+    """
+    if key == '_id':
+        return "'integer'", 'id'
+
+    return "json_type(data, '%s')" % json_path(key), field_expression(key)
+
+
+def decode_value(value_type, value):
+    """
+    Decode a value selected with distinct_expression
+
+    :param value_type: JSON type
+    :param value: value as returned by json_extract
+    :return: value
+    """
+    if value_type in ('true', 'false'):
+        return value_type == 'true'
+    if value_type in ('object', 'array'):
+        return json.loads(value)
+    return value
+
+
+def aggregate_clauses(group_by, aggregates, sort=None):
+    """
+    Build the columns, GROUP BY and ORDER BY clauses of an aggregation.
+    Each group key is selected as JSON type and value (see decode_value), followed by one column per aggregate.
+
+    :param group_by: List of keys to group by
+    :param aggregates: List of (result name, function, key) tuples, see query.normalize_aggregates
+    :param sort: List of (result name, direction) tuples, see query.normalize_sort
+    :return: tuple of SQL columns, GROUP BY and ORDER BY clause
+    """
+    columns = []
+    positions = {}
+
+    for key in group_by:
+        columns.extend(distinct_expression(key))
+        positions[key] = len(columns)
+
+    for name, function, key in aggregates:
+        columns.append('count(*)' if function == 'count' else AGGREGATE_FUNCTIONS[function] % field_expression(key))
+        positions[name] = len(columns)
+
+    # grouped by JSON type as well, so e.g. true and 1 are different groups. Without keys all documents form one
+    # constant group, which unlike a plain aggregate yields no row if nothing matches (like $group on MongoDB)
+    group = " group by ''"
+    if group_by:
+        group = ' group by ' + ', '.join(', '.join(distinct_expression(key)) for key in group_by)
+    order = ''
+    if sort:
+        order = ' order by ' + ', '.join('%d%s' % (positions[key], ' desc' if direction == DESCENDING else '')
+                                         for key, direction in sort)
+
+    return ', '.join(columns), group, order
+
+
+def index_statement(table, name, keys, unique=False):
+    """
+    Build the CREATE INDEX statement for an expression index on document keys
+
+    :param table: Table of the collection
+    :param name: Index name
+    :param keys: Index keys, see query.normalize_index
+    :param unique: Create a unique index
+    :return: SQL
+    """
+    keys = normalize_index(keys)
+    for key, direction in keys:
+        if direction not in (ASCENDING, DESCENDING):
+            raise ValueError('Index type "{0}" is not supported by nosqlite'.format(direction))
+
+    columns = ', '.join(field_expression(key) + (' desc' if direction == DESCENDING else '')
+                        for key, direction in keys)
+
+    return 'create %sindex if not exists %s on %s (%s)' % ('unique ' if unique else '', index_identifier(table, name),
+                                                          table, columns)
+
+
+def index_keys(statement):
+    """
+    Get the keys of an index from its CREATE INDEX statement, see index_statement
+
+    :param statement: SQL as stored in sqlite_master
+    :return: List of (key, direction) tuples
+    """
+    columns = statement[statement.index('(') + 1:]
+    keys = []
+    for path, descending in _index_column.findall(columns):
+        key = '.'.join(part.strip('"') for part in path.split('.')) if path else '_id'
+        keys.append((key, DESCENDING if descending else ASCENDING))
+
+    return keys
+
+
+def index_identifier(table, name):
+    """
+    Get the quoted SQLite name of an index, index names are unique per database in SQLite
+
+    :param table: Table of the collection
+    :param name: Index name
+    :return: SQL identifier
+    """
+    if '"' in name:
+        raise ValueError('Invalid index name "{0}"'.format(name))
+
+    return '"%s%s%s"' % (table, INDEX_SEPARATOR, name)
+
+
+def where_clause(query):
+    """
+    Translate a query to SQL conditions, see query.parse_query.
+    Parts that can not be translated are returned as remaining query, to be applied by match_clause.
+
+    :param query: Query to match with
+    :return: tuple of SQL conditions, parameters and the remaining query
+    """
+    conditions = []
+    params = []
+    remaining = {}
+
+    for node in parse_query(query):
+        translated = _translate(node)
+        if translated is None:
+            _merge(remaining, _to_query([node]))
+        else:
+            conditions.append(translated[0])
+            params.extend(translated[1])
+
+    if remaining:
+        warnings.warn('Query {0} can not be translated to SQL, it is applied in Python'
+                      .format(json.dumps(remaining, default=repr)), stacklevel=2)
+
+    return conditions, params, remaining
+
+
+def _translate(node):
+    """
+    Translate a node of a parsed query
+
+    :param node: Condition, Logical or Unsupported
+    :return: tuple of SQL and parameters, None if the node can not be translated
+    """
+    if isinstance(node, Condition):
+        return _condition(node.key, node.operator, node.value)
+
+    if not isinstance(node, Logical):
+        return None
+
+    parts = []
+    params = []
+    for nodes in node.children:
+        terms = []
+        for child in nodes:
+            translated = _translate(child)
+            if translated is None:
+                return None
+            terms.append(translated[0])
+            params.extend(translated[1])
+        parts.append('(%s)' % ' and '.join(terms) if terms else '1')
+
+    if node.operator == '$and':
+        return (' and '.join(parts) if parts else '1'), params
+
+    if node.operator == '$or':
+        return ('(%s)' % ' or '.join(parts) if parts else '0'), params
+
+    # $nor / $not: conditions on missing fields are null, which has to count as false here
+    return ('not coalesce(%s, 0)' % ' or '.join(parts) if parts else '1'), params
+
+
+def _condition(key, operator, value):
+    """
+    Translate a condition on a field
+
+    :return: tuple of SQL and parameters, None if the condition can not be translated
+    """
+    try:
+        expression = field_expression(key)
+    except ValueError:
+        return None
+
+    if operator == '$exists':
+        if value not in (True, False):
+            return None
+        if key == '_id':
+            return ('1' if value else '0'), []
+        return "json_type(data, '%s') is %snull" % (json_path(key), 'not ' if value else ''), []
+
+    if operator in ('$in', '$nin'):
+        if not isinstance(value, (list, tuple)) or \
+                not all(item is None or isinstance(item, SCALAR_TYPES) for item in value):
+            return None
+
+        values = [item for item in value if item is not None]
+        with_null = len(values) != len(value)
+        condition = '%s in (%s)' % (expression, ', '.join('?' * len(values))) if values else '0'
+
+        if operator == '$in':
+            if with_null:
+                condition = '(%s or %s is null)' % (condition, expression)
+            return condition, values
+
+        if with_null:
+            return '(%s is not null and not %s)' % (expression, condition), values
+        return '(%s is null or not %s)' % (expression, condition), values
+
+    if value is None:
+        if operator == '$eq':
+            return '%s is null' % expression, []
+        if operator == '$ne':
+            return '%s is not null' % expression, []
+        return None
+
+    if not isinstance(value, SCALAR_TYPES):
+        return None
+
+    if operator == '$ne':
+        return '(%s is null or %s != ?)' % (expression, expression), [value]
+
+    return '%s %s ?' % (expression, COMPARISONS[operator]), [value]
+
+
+def _to_query(nodes):
+    """
+    Turn parsed nodes back into a query
+
+    :param nodes: List of nodes, see query.parse_query
+    :return: Query
+    """
+    query = {}
+
+    for node in nodes:
+        if isinstance(node, Condition):
+            part = {node.key: node.value if node.operator == '$eq' else {node.operator: node.value}}
+        elif isinstance(node, Logical):
+            children = [_to_query(child) for child in node.children]
+            part = {node.operator: children[0] if node.operator == '$not' else children}
+        else:
+            part = node.query
+        _merge(query, part)
+
+    return query
+
+
+def _merge(query, part):
+    """
+    Add the keys of part to query, operators on the same field are combined
+    """
+    for key, value in part.items():
+        if key in query and isinstance(query[key], dict) and isinstance(value, dict):
+            query[key] = dict(query[key], **value)
+        else:
+            query[key] = value
+
+
+def patch_expression(values=None, unset=None, increments=None):
+    """
+    Get the SQL expression for a document with changed, removed and incremented fields
+
+    :param values: Dictionary of fields to set
+    :param unset: optional list of fields to remove
+    :param increments: optional dictionary of fields to increment
+    :return: tuple of SQL expression and parameters
+    """
+    expression = 'data'
+    params = []
+    terms = []
+
+    for key in sorted(values or {}):
+        terms.append("'%s', json(?)" % json_path(key))
+        params.append(json.dumps(values[key]))
+
+    for key in sorted(increments or {}):
+        terms.append("'%s', coalesce(%s, 0) + ?" % (json_path(key), field_expression(key)))
+        params.append(increments[key])
+
+    if terms:
+        expression = 'json_set(%s, %s)' % (expression, ', '.join(terms))
+
+    if unset:
+        expression = 'json_remove(%s, %s)' % (expression, ', '.join("'%s'" % json_path(key) for key in unset))
+
+    return expression, params
+
+
+def order_clause(order_by=None, reverse=False):
+    """
+    Build the ORDER BY clause, ties are ordered by id
+
+    :param order_by: Field(s) to order results by, see query.normalize_sort
+    :param reverse: Reverse ordering
+    :return: SQL
+    """
+    sort = normalize_sort(order_by, reverse)
+    terms = []
+
+    for key, direction in sort:
+        terms.append(field_expression(key) + (' desc' if direction == DESCENDING else ''))
+        if key == '_id':
+            # id is unique, further keys are irrelevant
+            return ' order by ' + ', '.join(terms)
+
+    # order ties by id in the direction of the last key
+    terms.append('id desc' if sort and sort[-1][1] == DESCENDING else 'id')
+
+    return ' order by ' + ', '.join(terms)
+
+
+def limit_clause(limit=None, offset=0):
+    """
+    Build the LIMIT / OFFSET clause
+
+    :param limit: Limit of documents to retrieve
+    :param offset: Offset
+    :return: tuple of SQL and parameters
+    """
+    if not limit and not offset:
+        return '', []
+
+    # a negative limit means no limit
+    return ' limit ? offset ?', [limit or -1, offset or 0]
+
+
+def match_clause(query):
+    """
+    Build a WHERE condition that applies a query in Python, see register_functions
+
+    :param query: Query to match with
+    :return: tuple of SQL and parameters
+    """
+    return '%s(?, id, data)' % MATCH_FUNCTION, [json.dumps(query, default=list)]
+
+
+def register_functions(db):
+    """
+    Register the Python functions used in SQL on a sqlite connection
+
+    :param db: sqlite3 connection
+    """
+    db.create_function(MATCH_FUNCTION, 3, _match)
+
+
+def _match(query, id_, data):
+    """
+    Check if a stored document matches the JSON encoded query
+    """
+    parsed = _parsed_queries.get(query)
+    if parsed is None:
+        if len(_parsed_queries) > 100:
+            _parsed_queries.clear()
+        parsed = _parsed_queries[query] = json.loads(query)
+
+    document = json.loads(data)
+    document['_id'] = id_
+
+    return _matcher._apply_query(parsed, document)
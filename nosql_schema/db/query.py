@@ -0,0 +1,453 @@
+"""
+This module contains the backend independent query helpers
+"""
+
+import base64
+import json
+import threading
+from ..helper import SchemaId
+from ..compat import string_types
+
+ASCENDING = 1
+DESCENDING = -1
+
+# operators whose value is a list of values, not of queries
+VALUE_LIST_OPERATORS = ('$in', '$nin', '$all')
+
+# shape of query parts without ids, they are passed through as they are
+_KEEP = None
+# shape of ids, they are converted with the id function of the backend
+_ID = 'id'
+
+# operators of field conditions, see parse_query
+COMPARISON_OPERATORS = ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$in', '$nin', '$exists')
+LOGICAL_OPERATORS = ('$and', '$or', '$nor')
+
+# compiled queries: {(shape, convert_id): plan}
+_plans = {}
+_plans_lock = threading.Lock()
+MAX_PLANS = 1000
+
+
+def normalize_sort(order_by=None, reverse=False):
+    """
+    Normalize the sort specification of find
+
+    :param order_by: None, a key, a list of keys or a list of (key, direction) tuples
+    :param reverse: Reverse ordering of all keys
+    :return: List of (key, direction) tuples, empty if no ordering was asked for
+    """
+    if order_by is None:
+        return []
+
+    if not isinstance(order_by, (list, tuple)):
+        order_by = [order_by]
+
+    sort = []
+    for item in order_by:
+        if isinstance(item, (list, tuple)):
+            key, direction = item
+            direction = DESCENDING if direction in (DESCENDING, 'desc', 'DESC') else ASCENDING
+        else:
+            key, direction = item, ASCENDING
+
+        if reverse:
+            direction = -direction
+
+        sort.append((key, direction))
+
+    return sort
+
+
+def normalize_projection(only=None, exclude=None):
+    """
+    Normalize the projection of find, '_id' is always included
+
+    :param only: List of fields to retrieve
+    :param exclude: List of fields to leave out
+    :return: Dictionary of field -> True (only) or field -> False (exclude), None for whole documents
+    """
+    if only is not None:
+        return dict((key, True) for key in only if key != '_id')
+
+    if exclude:
+        return dict((key, False) for key in exclude if key != '_id')
+
+    return None
+
+
+def normalize_aggregates(sum=None, avg=None, min=None, max=None, count=False):
+    """
+    Normalize the aggregate functions of aggregate
+
+    :param sum: Key, list of keys or dictionary of result name -> key, results are named e.g. 'sum_price'
+    :param avg: see sum
+    :param min: see sum
+    :param max: see sum
+    :param count: Count documents, True for a result named 'count' or the result name
+    :return: List of (result name, function, key) tuples, key is None for count
+    """
+    aggregates = []
+
+    for function, keys in (('sum', sum), ('avg', avg), ('min', min), ('max', max)):
+        if keys is None:
+            continue
+
+        if isinstance(keys, dict):
+            items = sorted(keys.items())
+        else:
+            if not isinstance(keys, (list, tuple)):
+                keys = [keys]
+            items = [('%s_%s' % (function, key.replace('.', '_')), key) for key in keys]
+
+        aggregates.extend((name, function, key) for name, key in items)
+
+    if count:
+        aggregates.append((count if isinstance(count, string_types) else 'count', 'count', None))
+
+    return aggregates
+
+
+def get_value(document, key):
+    """
+    Get the value of a (dotted) key of a document
+
+    :param document: Document
+    :param key: Key, e.g. 'author.name'
+    :return: value, None if the key is missing
+    """
+    value = document
+    for part in key.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+
+    return value
+
+
+def keyset_query(sort, values, nullable=None):
+    """
+    Build the query for the documents after a position in a sort order, see Schema.paginate.
+    The first key is also bounded on its own, so an index on it can be used for the range
+    (descending keys only if they can not be null, as nulls come last).
+
+    :param sort: List of (key, direction) tuples, the last key has to be unique (e.g. '_id')
+    :param values: Values of the keys at the position
+    :param nullable: optional set of keys that may be null or missing, all keys but '_id' if not given
+    :return: Query
+    """
+    if nullable is None:
+        nullable = set(key for key, direction in sort if key != '_id')
+
+    branches = []
+
+    for index, (key, direction) in enumerate(sort):
+        # same values for all previous keys, after the value of this key
+        branch = dict((k, v) for (k, d), v in zip(sort[:index], values[:index]))
+        value = values[index]
+
+        # null (or missing) comes first in ascending and last in descending order
+        if value is None:
+            if direction == DESCENDING:
+                continue
+            branch[key] = {'$ne': None}
+        elif direction == ASCENDING:
+            branch[key] = {'$gt': value}
+        elif key in nullable:
+            branch['$or'] = [{key: {'$lt': value}}, {key: None}]
+        else:
+            branch[key] = {'$lt': value}
+
+        branches.append(branch)
+
+    query = branches[0] if len(branches) == 1 else {'$or': branches}
+
+    first_key, first_direction = sort[0]
+    if len(branches) > 1 and values[0] is not None:
+        if first_direction == ASCENDING:
+            query = {'$and': [{first_key: {'$gte': values[0]}}, query]}
+        elif first_key not in nullable:
+            query = {'$and': [{first_key: {'$lte': values[0]}}, query]}
+
+    return query
+
+
+def encode_token(values):
+    """
+    Encode a position for paginate as an opaque token
+
+    :param values: List of JSON serializable values
+    :return: Token
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_token(token, size):
+    """
+    Decode a token of encode_token
+
+    :param token: Token
+    :param size: Expected number of values
+    :return: List of values
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(token)).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid page token "{0}"'.format(token))
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid page token "{0}"'.format(token))
+
+    return values
+
+
+def normalize_index(keys):
+    """
+    Normalize the keys of an index, like normalize_sort.
+    Special index types like 'text', '2dsphere' or 'hashed' are kept as direction.
+
+    :param keys: key, list of keys or list of (key, direction) tuples
+    :return: List of (key, direction) tuples
+    """
+    if not isinstance(keys, (list, tuple)):
+        keys = [keys]
+
+    normalized = []
+    for item in keys:
+        if isinstance(item, (list, tuple)) and item[1] not in (ASCENDING, DESCENDING, 'asc', 'ASC', 'desc', 'DESC'):
+            normalized.append((item[0], item[1]))
+        else:
+            normalized.extend(normalize_sort([item]))
+
+    return normalized
+
+
+def index_signature(keys):
+    """
+    Get a comparable form of normalized index keys.
+    MongoDB reports the fields of a text index by name, so their order is ignored.
+
+    :param keys: List of (key, direction) tuples, see normalize_index
+    :return: tuple of keys in order and sorted text keys
+    """
+    ordered = tuple((key, direction) for key, direction in keys if direction != 'text')
+    text = tuple(sorted(key for key, direction in keys if direction == 'text'))
+
+    return ordered, text
+
+
+def index_name(keys):
+    """
+    Get the default name of an index, like MongoDB does
+
+    :param keys: Index keys, see normalize_index
+    :return: Name, e.g. 'name_1_created_-1' or 'location_2dsphere'
+    """
+    return '_'.join('%s_%s' % (key, direction) for key, direction in normalize_index(keys))
+
+
+class Condition:
+    """
+    Condition on a field: key operator value, e.g. ('age', '$gt', 18)
+    """
+
+    def __init__(self, key, operator, value):
+        self.key = key
+        self.operator = operator
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Condition) and \
+            (self.key, self.operator, self.value) == (other.key, other.operator, other.value)
+
+    def __repr__(self):
+        return 'Condition(%r, %r, %r)' % (self.key, self.operator, self.value)
+
+
+class Logical:
+    """
+    Combination of queries: '$and', '$or', '$nor' or '$not' of a list of nodes (implicitly combined with $and)
+    """
+
+    def __init__(self, operator, children):
+        self.operator = operator
+        self.children = children
+
+    def __eq__(self, other):
+        return isinstance(other, Logical) and (self.operator, self.children) == (other.operator, other.children)
+
+    def __repr__(self):
+        return 'Logical(%r, %r)' % (self.operator, self.children)
+
+
+class Unsupported:
+    """
+    Part of a query that is no Condition or Logical, e.g. {'tags': {'$all': [...]}}
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+    def __eq__(self, other):
+        return isinstance(other, Unsupported) and self.query == other.query
+
+    def __repr__(self):
+        return 'Unsupported(%r)' % (self.query,)
+
+
+def parse_query(query):
+    """
+    Parse a Mongo-style query into a list of nodes that all have to match.
+    Backends translate the nodes they support, see nosqlite.sql.where_clause.
+
+    :param query: Query to match with
+    :return: List of Condition, Logical and Unsupported nodes
+    """
+    nodes = []
+
+    for key in sorted(query or {}):
+        value = query[key]
+
+        if key in LOGICAL_OPERATORS:
+            if isinstance(value, (list, tuple)) and all(isinstance(item, dict) for item in value):
+                nodes.append(Logical(key, [parse_query(item) for item in value]))
+            else:
+                nodes.append(Unsupported({key: value}))
+        elif key == '$not' and isinstance(value, dict):
+            nodes.append(Logical(key, [parse_query(value)]))
+        elif key.startswith('$'):
+            nodes.append(Unsupported({key: value}))
+        elif isinstance(value, dict) and value and all(operator.startswith('$') for operator in value):
+            for operator in sorted(value):
+                if operator in COMPARISON_OPERATORS:
+                    nodes.append(Condition(key, operator, value[operator]))
+                else:
+                    nodes.append(Unsupported({key: {operator: value[operator]}}))
+        else:
+            nodes.append(Condition(key, '$eq', value))
+
+    return nodes
+
+
+def convert_query(query, convert_id):
+    """
+    Convert all ids of a query for a backend.
+    The query is reduced to its shape (keys and positions of ids) and its values, the plan to rebuild a query
+    of a shape is compiled once and cached. Only the parts of the query that contain ids are copied, all other
+    values (e.g. long $in lists of other fields) are used as they are.
+
+    :param query: Query that has to be transformed
+    :param convert_id: function(id) -> id of the backend, called for '_id' values and SchemaId
+    :return: Transformed query, the query itself if it contains no ids
+    """
+    if not isinstance(query, dict):
+        return query
+
+    values = []
+    shape = _shape(query, False, values)
+    if shape is _KEEP:
+        return query
+
+    key = (shape, convert_id)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _compile(shape, convert_id)
+        with _plans_lock:
+            if len(_plans) >= MAX_PLANS:
+                _plans.clear()
+            _plans[key] = plan
+
+    return plan(iter(values))
+
+
+def _shape(value, is_id, values):
+    """
+    Get the shape of a query part and collect its values in order
+
+    :param value: Query part
+    :param is_id: Indicates that the current part derived from an '_id'
+    :param values: List to append the values to
+    :return: Shape, _KEEP for parts without ids
+    """
+    if isinstance(value, SchemaId):
+        values.append(value.id_list if value.is_list else value.id_)
+        return _ID
+
+    if isinstance(value, dict):
+        start = len(values)
+        items = []
+        keep = True
+
+        for k in sorted(value):
+            v = value[k]
+            if not is_id and k in VALUE_LIST_OPERATORS:
+                shape = _KEEP
+            else:
+                shape = _shape(v, is_id or k == '_id', values)
+            if shape is _KEEP:
+                values.append(v)
+            else:
+                keep = False
+            items.append((k, shape))
+
+        if keep:
+            del values[start:]
+            return _KEEP
+
+        return 'dict', tuple(items)
+
+    if is_id:
+        values.append(value)
+        return _ID
+
+    if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+        # e.g. $or: [...], other lists are values
+        start = len(values)
+        items = []
+        keep = True
+
+        for item in value:
+            shape = _shape(item, False, values)
+            if shape is _KEEP:
+                values.append(item)
+            else:
+                keep = False
+            items.append(shape)
+
+        if keep:
+            del values[start:]
+            return _KEEP
+
+        return 'list', tuple(items)
+
+    return _KEEP
+
+
+def _compile(shape, convert_id):
+    """
+    Compile the plan for a query shape
+
+    :param shape: Shape, see _shape
+    :param convert_id: function(id) -> id of the backend
+    :return: function(values) -> query, values is an iterator of the values collected by _shape
+    """
+    if shape is _KEEP:
+        return next
+
+    if shape == _ID:
+        def convert(values):
+            value = next(values)
+            if isinstance(value, (list, tuple)):
+                return [convert_id(item) for item in value]
+            return convert_id(value)
+
+        return convert
+
+    kind, items = shape
+
+    if kind == 'dict':
+        builders = tuple((k, _compile(item, convert_id)) for k, item in items)
+        return lambda values: dict((k, build(values)) for k, build in builders)
+
+    builders = tuple(_compile(item, convert_id) for item in items)
+    return lambda values: [build(values) for build in builders]
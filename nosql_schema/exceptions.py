@@ -11,3 +11,10 @@ class ValidationError(Exception):
 class PasswordFuncError(Exception):
     def __init__(self, message,):
         super(PasswordFuncError, self).__init__(message)
+
+
+class BulkWriteError(Exception):
+    def __init__(self, message, errors=None):
+        super(BulkWriteError, self).__init__(message)
+        # list of (object, error) tuples
+        self.errors = errors or []
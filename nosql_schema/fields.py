@@ -2,15 +2,31 @@
 This module contains the Field-class definitions
 """
 
+from itertools import count
 from .validators import *
 from .post_processors import *
 from .exceptions import PasswordFuncError
+from .compat import text_type
 
 
-class Field:
+class Field(object):
     validators = [Validator]
 
+    # keeps track of the declaration order of fields
+    _creation_counter = count()
+
+    # compiled validators, see compile
+    _validate = None
+
+    # attribute name, set by SchemaMeta
+    name = None
+
+    # referenced Schema class, see ReferenceField
+    references = None
+
     def __init__(self, **kwargs):
+        self.creation_order = next(Field._creation_counter)
+
         try:
             self.required = kwargs.pop('required')
         except KeyError:
@@ -29,6 +45,67 @@ class Field:
         except KeyError:
             self.post_processors = None
 
+    def __setattr__(self, key, value):
+        """
+        Changed constraints (e.g. field.min = 1) invalidate the compiled validators, see compile
+        """
+        object.__setattr__(self, key, value)
+        if key != '_validate' and self._validate is not None:
+            self._validate = None
+
+    def __get__(self, instance, owner):
+        """
+        Only called if the object has no value for this field, e.g. a field left out by a projection
+        """
+        if instance is not None and getattr(instance, '_deferred', None):
+            return instance._load_deferred(self)
+        return self
+
+    def _value(self, instance):
+        """
+        Get the stored value of this field, for fields that define __set__
+
+        :param instance: Schema object
+        :return: value
+        """
+        raw_document = instance.__dict__
+        if self.name in raw_document:
+            return raw_document[self.name]
+
+        if getattr(instance, '_deferred', None):
+            instance._load_deferred()
+            return raw_document.get(self.name)
+
+        return None
+
+    def dump(self, value):
+        """
+        Convert a value to its stored form
+
+        :param value: value of the field
+        :return: value to store
+        """
+        return value
+
+    def reference_ids(self, value):
+        """
+        Get the ids of referenced objects that are not loaded yet, see ReferenceField
+
+        :param value: value of the field
+        :return: List of ids
+        """
+        return []
+
+    def resolve(self, value, objects):
+        """
+        Replace ids with loaded objects, see ReferenceField
+
+        :param value: value of the field
+        :param objects: Dictionary of text_type(_id) -> object
+        :return: value
+        """
+        return value
+
     def process(self, value=None):
         if type(self.post_processors) is not list:
             return value
@@ -40,12 +117,45 @@ class Field:
         return value
 
     def validate(self, value=None):
-        valid = True
+        validate = self._validate
+        if validate is None:
+            validate = self.compile()
 
+        return validate(value)
+
+    def compile(self):
+        """
+        Compile the validators into one function, see Validator.compile.
+        Called on first validation and again after the field's attributes changed.
+
+        :return: function(value) -> bool
+        """
+        checks = []
+        for validator in self.validators:
+            check = validator.compile(self)
+            if check is not None:
+                checks.append(check)
+        checks = tuple(checks)
+
+        # the result for None only depends on the field
+        none_valid = True
         for validator in self.validators:
-            valid = valid and validator.validate(value=value, field=self)
+            if not validator.validate(value=None, field=self):
+                none_valid = False
+                break
+
+        def validate(value):
+            if value is None:
+                return none_valid
+
+            for check in checks:
+                if not check(value):
+                    return False
 
-        return valid
+            return True
+
+        self._validate = validate
+        return validate
 
 
 class NumberField(Field):
@@ -169,9 +279,16 @@ class DictField(Field):
 class ListField(Field):
     validators = [Validator, ListValidator]
 
-    def __init__(self, **kwargs):
+    def __init__(self, field=None, **kwargs):
+        """
+        :param field: optional Field for all items, e.g. ListField(ReferenceField(User))
+        """
         Field.__init__(self, **kwargs)
 
+        self.field = field
+        if field is not None:
+            self.references = field.references
+
         try:
             self.allowed_values = kwargs.pop('allowed_values')
         except KeyError:
@@ -186,3 +303,85 @@ class ListField(Field):
             self.custom_type = kwargs.pop('custom_type')
         except KeyError:
             self.custom_type = None
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = self._value(instance)
+        ids = self.reference_ids(value)
+        if ids:
+            # load all referenced objects with one query, missing objects stay ids
+            objects = dict((text_type(obj._id), obj) for obj in self.references.get_many(ids) if obj is not None)
+            self.resolve(value, objects)
+
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def dump(self, value):
+        if self.field is None or not isinstance(value, list):
+            return value
+        return [self.field.dump(item) for item in value]
+
+    def reference_ids(self, value):
+        if self.references is None or not isinstance(value, list):
+            return []
+        return [item for item in value if item is not None and not isinstance(item, self.references)]
+
+    def resolve(self, value, objects):
+        if self.references is not None and isinstance(value, list):
+            # in place, so the list of the object stays the same
+            for index, item in enumerate(value):
+                if item is not None and not isinstance(item, self.references):
+                    value[index] = objects.get(text_type(item), item)
+        return value
+
+
+class ReferenceField(Field):
+    """
+    Reference to an object of another Schema class.
+    The _id is stored, the object is loaded on first access, see also find(prefetch=...).
+    """
+    validators = [Validator, ReferenceValidator]
+
+    def __init__(self, schema, **kwargs):
+        """
+        :param schema: Referenced Schema class
+        """
+        Field.__init__(self, **kwargs)
+
+        self.references = schema
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = self._value(instance)
+        if value is None or isinstance(value, self.references):
+            return value
+
+        obj = self.references.find_one({'_id': value})
+        if obj is not None:
+            instance.__dict__[self.name] = obj
+
+        return obj
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def dump(self, value):
+        if isinstance(value, self.references):
+            return value._id
+        return value
+
+    def reference_ids(self, value):
+        if value is None or isinstance(value, self.references):
+            return []
+        return [value]
+
+    def resolve(self, value, objects):
+        if value is None or isinstance(value, self.references):
+            return value
+        return objects.get(text_type(value), value)
@@ -8,4 +8,52 @@ class SchemaId:
             self.is_list = True
             self.id_list = id_
         else:
-            self.id = id_
+            self.id_ = id_
+
+
+class BulkResult:
+    """
+    Result of a bulk operation
+    ids: assigned ids in input order, None for failed documents
+    errors: dictionary of input index -> error
+    """
+
+    def __init__(self, size=0):
+        self.ids = [None] * size
+        self.errors = {}
+
+    @property
+    def success(self):
+        """
+        True if no document failed
+
+        :return: bool
+        """
+        return not self.errors
+
+
+class Page:
+    """
+    Page of Schema.paginate
+    items: objects of the page
+    next_token: token for the next page (after=...), None on the last page
+    """
+
+    def __init__(self, items, next_token=None):
+        self.items = items
+        self.next_token = next_token
+
+    @property
+    def has_next(self):
+        """
+        True if there is a next page
+
+        :return: bool
+        """
+        return self.next_token is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
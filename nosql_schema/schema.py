@@ -2,39 +2,104 @@
 This module contains the Schema-class definition
 """
 
-from .fields import Field
+from collections import OrderedDict
+from copy import deepcopy
+from .fields import Field, NumberField
+from .validators import NUMBER_TYPES
 from .exceptions import ValidationError
+from .helper import BulkResult, Page
+from .cache import QueryCache, make_key
+from .compat import text_type
+from .session import current_session
 from .db import get_default_handler, create_handler
+from .db.query import normalize_projection, normalize_sort, normalize_aggregates, normalize_index, index_signature, \
+    index_name, get_value, keyset_query, encode_token, decode_token, ASCENDING, DESCENDING
 
+# resolved DatabaseHandler per Schema class: {cls: (config, handler)}
+_handlers = {}
 
-class Schema:
+# query cache per Schema class: {cls: (config, cache)}
+_caches = {}
+
+
+class SchemaMeta(type):
+    """
+    Schema Metaclass
+    Collects the fields of a Schema class once, when the class is created.
+    """
+
+    def __new__(mcs, name, bases, attributes):
+        cls = super(SchemaMeta, mcs).__new__(mcs, name, bases, attributes)
+
+        # walk the bases first, so fields of a subclass override inherited ones
+        fields = OrderedDict()
+        for klass in reversed(cls.__mro__):
+            declared = [(k, v) for k, v in klass.__dict__.items() if isinstance(v, Field)]
+            for k, v in sorted(declared, key=lambda item: item[1].creation_order):
+                fields[k] = v
+
+        # attributes that replace an inherited field with a non-field value remove it
+        cls._fields = tuple((k, v) for k, v in fields.items() if isinstance(getattr(cls, k, None), Field))
+
+        for k, v in cls._fields:
+            if v.name is None:
+                v.name = k
+
+        return cls
+
+
+# base class created with SchemaMeta, works with the metaclass syntax of Python 2 and 3
+_SchemaBase = SchemaMeta('_SchemaBase', (object,), {})
+
+
+class Schema(_SchemaBase):
     __config__ = None
 
+    # declared indexes, see ensure_indexes
+    __indexes__ = None
+
+    # query cache configuration, e.g. {'size': 128, 'ttl': 60}, see get_query_cache
+    __cache__ = None
+
+    # fields that have not been loaded yet, see find(only=..., exclude=...)
+    _deferred = None
+
+    # stored field values, used to only write changed fields, see save
+    _snapshot = None
+
     def __init__(self, *args, **kwargs):
         """
         Instantiate new object
 
         :param __dictionary: Dictionary to use for object attributes
+        :param __deferred: Fields to leave unset, they are loaded on first access
         """
 
         self._id = None
-        self.__database_handle = self.__class__.get_handler()
-
-        attributes = self.__class__.__dict__
 
         # creation by dictionary -> see find / find_one
         field_dictionary = kwargs.pop('__dictionary', None)
         if field_dictionary and '_id' in field_dictionary:
             setattr(self, '_id', field_dictionary.pop('_id'))
 
+        deferred = kwargs.pop('__deferred', None)
+        if deferred:
+            self._deferred = deferred
+
         # set default values, override with passed values, then with __dictionary
-        for k, v in attributes.iteritems():
-            if isinstance(v, Field):
-                setattr(self, k, v.default)
-                if k in kwargs:
-                    setattr(self, k, kwargs.pop(k))
-                if field_dictionary and k in field_dictionary:
-                    setattr(self, k, field_dictionary.pop(k))
+        for k, v in self._fields:
+            if deferred and k in deferred:
+                continue
+
+            value = v.default
+            if k in kwargs:
+                value = kwargs.pop(k)
+            if field_dictionary and k in field_dictionary:
+                value = field_dictionary.pop(k)
+            setattr(self, k, value)
+
+        if self._id is not None:
+            self.__take_snapshot()
 
     @property
     def id(self):
@@ -46,6 +111,10 @@ class Schema:
         return self._id
 
     def save(self):
+        if self._deferred:
+            # validation and post-processing need all fields, missing ones would be written as None
+            self._load_deferred()
+
         if not self.__validate():
             return False
 
@@ -56,20 +125,25 @@ class Schema:
 
         if self._id is not None:
             # update
-            self.__class__.on_update(document)
-            with self.__database_handle as db:
+            changes = self.__changes(document)
+            if changes is None:
+                return self._id
+
+            with self.__class__.get_handler() as db:
                 collection_name = self.__class__.__name__
                 collection = db[collection_name]
-                collection.update(document)
+                self.__update(collection, document, changes)
                 return self._id
         else:
             # insert
             self.__class__.on_create(document)
-            with self.__database_handle as db:
+            with self.__class__.get_handler() as db:
                 collection_name = self.__class__.__name__
                 collection = db[collection_name]
                 document = collection.insert(document)
+                self.__class__._invalidate_cache()
                 self._id = document['_id']
+                self.__take_snapshot()
                 self.__class__.after_create(document)
                 return self._id
 
@@ -77,51 +151,182 @@ class Schema:
         document = self.to_dict()
         if '_id' in document:
             self.__class__.on_delete(document)
-            with self.__database_handle as db:
+            with self.__class__.get_handler() as db:
+                collection_name = self.__class__.__name__
+                collection = db[collection_name]
+                result = collection.delete({'_id': document['_id']})
+                self.__class__._invalidate_cache()
+                self.__class__._evict(document['_id'])
+                return result
+
+    def __update(self, collection, document, changes):
+        """
+        Write an existing object, only changed fields are sent if the object was loaded
+
+        :param collection: CollectionHandler
+        :param document: Document of the object
+        :param changes: Changed fields before on_update, see __changes
+        """
+        changes = self.__before_update(document, changes)
+
+        if changes is None:
+            collection.update(document)
+        else:
+            collection.update_fields(self._id, changes)
+
+        self.__class__._invalidate_cache()
+        self.__take_snapshot()
+
+    def __before_update(self, document, changes):
+        """
+        Call on_update for an existing object before it is written
+
+        :param document: Document of the object
+        :param changes: Changed fields, see __changes
+        :return: Changed fields to write, None if the whole document has to be written (object was not loaded)
+        """
+        self.__class__.on_update(document)
+
+        if self._snapshot is None:
+            return None
+
+        # the hook may have changed the document
+        return self.__changes(document) or changes
+
+    def __changes(self, document):
+        """
+        Get the fields that changed since the object was loaded or saved
+
+        :param document: Document of the object
+        :return: Dictionary of changed values, None if nothing changed
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return document
+
+        # documents always contain all fields, so fields are changed but never removed
+        values = dict((k, v) for k, v in document.items()
+                      if k != '_id' and (k not in snapshot or snapshot[k] != v))
+
+        return values or None
+
+    def __take_snapshot(self, keys=None):
+        """
+        Remember the stored values of all loaded fields
+
+        :param keys: optional fields to add to the current snapshot
+        """
+        raw_document = self.__dict__
+        deferred = self._deferred
+        snapshot = {} if keys is None else self._snapshot
+
+        for k, v in self._fields:
+            if (deferred and k in deferred) or (keys is not None and k not in keys):
+                continue
+
+            value = v.dump(raw_document.get(k))
+            # copy containers, so changes in place are noticed
+            if isinstance(value, (dict, list)):
+                value = deepcopy(value)
+            snapshot[k] = value
+
+        self._snapshot = snapshot
+
+    def _load_deferred(self, field=None):
+        """
+        Load all fields left out by a projection
+
+        :param field: optional Field to return the value for
+        :return: value of field
+        """
+        deferred = self._deferred
+        self._deferred = None
+
+        document = {}
+        if self._id is not None:
+            with self.__class__.get_handler() as db:
                 collection_name = self.__class__.__name__
                 collection = db[collection_name]
-                return collection.delete({'_id': document['_id']})
+                projection = normalize_projection(only=deferred)
+                documents = collection.find({'_id': self._id}, limit=1, projection=projection)
+                if documents:
+                    document = documents[0]
+
+        value = field
+        for k, v in self._fields:
+            if k in deferred:
+                setattr(self, k, document.get(k, v.default))
+                if v is field:
+                    value = getattr(self, k)
+
+        if self._snapshot is not None:
+            self.__take_snapshot(deferred)
+
+        return value
+
+    def increment(self, field, by=1):
+        """
+        Atomically increment a number field in database, see update_many
+
+        :param field: Name of the field
+        :param by: Value to add
+        :return: New value of the field (without increments by others, unless the field was not loaded)
+        """
+        if self._id is None:
+            raise ValidationError('Object has to be saved before incrementing "{0}"'.format(field))
+
+        self.__class__.update_many({'_id': self._id}, {'$inc': {field: by}})
+
+        if self._deferred and field in self._deferred:
+            # the local value is unknown, load the stored one
+            return getattr(self, field)
+
+        value = (self.__dict__.get(field) or 0) + by
+        setattr(self, field, value)
+        if self._snapshot is not None:
+            self._snapshot[field] = value
+
+        session = current_session()
+        if session is not None:
+            # this object is up to date, keep it in the identity map
+            session.register(self)
+
+        return value
 
     def __validate(self):
-        attributes = self.__class__.__dict__
-        document = self.to_dict()
-        for k, v in attributes.iteritems():
-            if isinstance(v, Field):
-                # workaround for getattr(self, k) as it returns class attribute if value is None?!
-                value = document.get(k)
+        raw_document = self.__dict__
+        for k, v in self._fields:
+            # workaround for getattr(self, k) as it returns class attribute if value is None?!
+            value = raw_document.get(k)
 
-                if not v.validate(value=value):
-                    raise ValidationError('Invalid value "{0}" for field "{1}"'.format(value, k))
+            if not v.validate(value=value):
+                raise ValidationError('Invalid value "{0}" for field "{1}"'.format(value, k))
 
         return True
 
     def __post_process(self):
-        attributes = self.__class__.__dict__
-        document = self.to_dict()
-        for k, v in attributes.iteritems():
-            if isinstance(v, Field):
-                # workaround for getattr(self, k) as it returns class attribute if value is None?!
-                value = document.get(k)
+        raw_document = self.__dict__
+        for k, v in self._fields:
+            # workaround for getattr(self, k) as it returns class attribute if value is None?!
+            value = raw_document.get(k)
 
-                # process value
-                value = v.process(value)
+            # process value
+            value = v.process(value)
 
-                # set attribute to self object
-                setattr(self, k, value)
+            # set attribute to self object
+            setattr(self, k, value)
 
     def to_dict(self):
         # remove all undefined attributes and add defined attributes
         raw_document = self.__dict__
         document = dict()
-        attributes = self.__class__.__dict__
 
-        for k, v in attributes.iteritems():
-            if isinstance(v, Field):
-                if k in raw_document:
-                    document[k] = raw_document[k]
-                else:
-                    # actually not necessary
-                    document[k] = None
+        for k, v in self._fields:
+            if k in raw_document:
+                document[k] = v.dump(raw_document[k])
+            else:
+                # actually not necessary
+                document[k] = None
 
         if '_id' in raw_document and raw_document['_id'] is not None:
             document['_id'] = raw_document['_id']
@@ -133,72 +338,582 @@ class Schema:
     def get_handler(cls):
         """
         Get DatabaseHandler
+        The handler is created once per class and reused until __config__ changes.
 
         :return: DatabaseHandler
         """
         config = cls.__config__
 
+        cached = _handlers.get(cls)
+        if cached is not None and cached[0] == config:
+            return cached[1]
+
         if config is None:
             handler = get_default_handler()
         else:
             handler = create_handler(**config)
+            # copy to detect changes of the config dictionary itself
+            config = dict(config)
+
+        _handlers[cls] = (config, handler)
 
         return handler
 
     @classmethod
-    def find(cls, query=None, limit=None, order_by=None, reverse=False, offset=0, sort_native=False):
+    def save_all(cls, instances, batch_size=1000):
+        """
+        Save many objects at once.
+        New objects are inserted in batches, existing objects are updated.
+
+        :param instances: List of objects of this class
+        :param batch_size: Number of documents per batched write
+        :return: BulkResult with ids and errors by position in instances
+        """
+        instances = list(instances)
+        result = BulkResult(len(instances))
+        updates = []
+        inserts = []
+
+        for index, instance in enumerate(instances):
+            if instance._deferred:
+                # see save
+                instance._load_deferred()
+
+            try:
+                instance.__validate()
+            except ValidationError as e:
+                result.errors[index] = e
+                continue
+
+            instance.__post_process()
+            document = instance.to_dict()
+
+            if instance._id is not None:
+                updates.append((index, document))
+            else:
+                inserts.append((index, document))
+
+        with cls.get_handler() as db:
+            collection_name = cls.__name__
+            collection = db[collection_name]
+
+            for start in range(0, len(updates), batch_size):
+                written = []
+                field_updates = []
+
+                for index, document in updates[start:start + batch_size]:
+                    instance = instances[index]
+                    result.ids[index] = instance._id
+
+                    changes = instance.__changes(document)
+                    if changes is None:
+                        continue
+
+                    changes = instance.__before_update(document, changes)
+                    if changes is None:
+                        collection.update(document)
+                    else:
+                        field_updates.append((instance._id, changes))
+                    written.append(instance)
+
+                # loaded objects are written with one batched write
+                if field_updates:
+                    collection.update_fields_many(field_updates)
+
+                if written:
+                    cls._invalidate_cache()
+                    for instance in written:
+                        instance.__take_snapshot()
+
+            for start in range(0, len(inserts), batch_size):
+                batch = inserts[start:start + batch_size]
+                documents = [document for index, document in batch]
+
+                for document in documents:
+                    cls.on_create(document)
+
+                batch_result = collection.insert_many(documents)
+                cls._invalidate_cache()
+
+                for position, (index, document) in enumerate(batch):
+                    if position in batch_result.errors:
+                        result.errors[index] = batch_result.errors[position]
+                        continue
+
+                    instances[index]._id = batch_result.ids[position]
+                    instances[index].__take_snapshot()
+                    result.ids[index] = batch_result.ids[position]
+                    cls.after_create(document)
+
+        return result
+
+    @classmethod
+    def update_many(cls, query, update):
+        """
+        Update all matching documents in database without loading them.
+        Values are validated and post-processed like on save.
+
+        :param query: Query to match with
+        :param update: Dictionary of update operators: $set, $unset and $inc
+        :return: Number of updated documents
+        """
+        update = cls.__validate_update(update)
+
+        with cls.get_handler() as db:
+            collection_name = cls.__name__
+            collection = db[collection_name]
+
+            result = collection.update_many(query, update)
+            cls._invalidate_cache()
+            cls._evict()
+            return result
+
+    @classmethod
+    def delete_many(cls, query=None, hooks=False):
+        """
+        Delete all matching documents from database without loading them.
+
+        :param query: Query to match with
+        :param hooks: Load the matching objects to call on_delete for each of them
+        :return: Number of deleted documents
+        """
+        if hooks:
+            for obj in cls.iter_find(query):
+                cls.on_delete(obj.to_dict())
+
+        with cls.get_handler() as db:
+            collection_name = cls.__name__
+            collection = db[collection_name]
+
+            result = collection.delete_many(query)
+            cls._invalidate_cache()
+            cls._evict()
+            return result
+
+    @classmethod
+    def __validate_update(cls, update):
+        """
+        Validate the update operators of update_many against the fields
+
+        :param update: Dictionary of update operators
+        :return: Validated and post-processed update
+        """
+        fields = dict(cls._fields)
+        validated = {}
+
+        for operator, values in update.items():
+            if operator not in ('$set', '$unset', '$inc'):
+                raise ValidationError('Unsupported update operator "{0}"'.format(operator))
+
+            for k in values:
+                if k not in fields:
+                    raise ValidationError('Unknown field "{0}"'.format(k))
+
+            field_values = values
+            if operator == '$set':
+                field_values = {}
+                for k, value in values.items():
+                    if not fields[k].validate(value=value):
+                        raise ValidationError('Invalid value "{0}" for field "{1}"'.format(value, k))
+                    # stored form, e.g. the id of a referenced object
+                    field_values[k] = fields[k].dump(fields[k].process(value))
+            elif operator == '$unset':
+                field_values = list(values)
+                for k in field_values:
+                    if fields[k].required:
+                        raise ValidationError('Required field "{0}" can not be unset'.format(k))
+            elif operator == '$inc':
+                for k, value in values.items():
+                    if not isinstance(fields[k], NumberField) or type(value) not in NUMBER_TYPES:
+                        raise ValidationError('Invalid increment "{0}" for field "{1}"'.format(value, k))
+
+            validated[operator] = field_values
+
+        return validated
+
+    @classmethod
+    def get_query_cache(cls):
+        """
+        Get the query cache of this class, configured by __cache__
+        (dictionary with 'size' and optional 'ttl' in seconds).
+        Results of find, find_one and count are cached until the class writes to database.
+
+        :return: QueryCache or None if caching is disabled
+        """
+        config = cls.__cache__
+
+        cached = _caches.get(cls)
+        if cached is not None and cached[0] == config:
+            return cached[1]
+
+        cache = None
+        if config is not None:
+            cache = QueryCache(**config)
+            config = dict(config)
+
+        _caches[cls] = (config, cache)
+
+        return cache
+
+    @classmethod
+    def _invalidate_cache(cls):
+        """
+        Remove all cached query results of this class
+        """
+        cache = cls.get_query_cache()
+        if cache is not None:
+            cache.clear()
+
+    @classmethod
+    def _evict(cls, id_=None):
+        """
+        Remove objects of this class from the identity map of the active Session
+
+        :param id_: optional _id, all objects of this class are removed if not given
+        """
+        session = current_session()
+        if session is not None:
+            session.evict(cls, id_)
+
+    @classmethod
+    def find(cls, query=None, limit=None, order_by=None, reverse=False, offset=0, sort_native=False, only=None,
+             exclude=None, prefetch=None):
+        """
+        Find all matching objects
+
+        :param query: Query to match with
+        :param limit: Limit of objects to retrieve
+        :param order_by: Field to order results by, or a list of fields / (field, direction) tuples
+        :param reverse: Reverse ordering
+        :param offset: Offset
+        :param sort_native: Let the database sort the results (always done by backends that can, see
+                            CollectionHandler.native_sort, for a list of fields and with limit or offset)
+        :param only: List of fields to retrieve, other fields are loaded on first access
+        :param exclude: List of fields not to retrieve, they are loaded on first access
+        :param prefetch: List of reference fields to load with one query per referenced class
+        :return: List of objects
+        """
+        projection, deferred = cls.__projection(only, exclude)
+        # pages have to be selected in sort order, which only the database can do
+        sort_native = sort_native or isinstance(order_by, (list, tuple)) or \
+            (order_by is not None and bool(limit or offset))
+
+        cache = cls.get_query_cache()
+        key = None
+        if cache is not None:
+            # None if the query can not be cached
+            key = make_key('find', query, limit, order_by, reverse, offset, sort_native, projection)
+        if key is not None:
+            generation = cache.generation
+            found, cached = cache.get(key)
+            if found:
+                sort_native, documents = cached[0], deepcopy(cached[1])
+
+        if key is None or not found:
+            database_handle = cls.get_handler()
+
+            with database_handle as db:
+                collection_name = cls.__name__
+                collection = db[collection_name]
+
+                sort_native = sort_native or collection.native_sort
+                if sort_native:
+                    documents = collection.find(query, limit, offset, order_by, reverse, projection)
+                else:
+                    documents = collection.find(query, limit, offset, projection=projection)
+
+            if key is not None:
+                cache.set(key, (sort_native, deepcopy(documents)), generation)
+
+        results = [cls(__dictionary=document, __deferred=deferred) for document in documents]
+
+        # fallback for backends without native sorting
+        if order_by is not None and not sort_native:
+            def deep_sort(d, order_key):
+                keys = order_key.split('.')
+                val = d
+                for key in keys:
+                    val = getattr(val, key)
+                    if val is None:
+                        return None
+                return val
+
+            results = sorted(results, key=lambda d: deep_sort(d, order_by), reverse=reverse)
+
+        session = current_session()
+        if session is not None:
+            results = [session.register(result) for result in results]
+
+        if prefetch:
+            cls.__prefetch(results, prefetch)
+
+        return results
+
+    @classmethod
+    def __prefetch(cls, objects, names):
+        """
+        Load the objects referenced by the given fields, one get_many per referenced class
+
+        :param objects: List of objects of this class
+        :param names: List of ReferenceField / ListField(ReferenceField(...)) names
+        """
+        fields = dict(cls._fields)
+        ids = {}
+
+        for name in names:
+            field = fields.get(name)
+            if field is None or field.references is None:
+                raise ValueError('Field "{0}" is no reference of {1}'.format(name, cls.__name__))
+
+            collected = ids.setdefault(field.references, [])
+            for obj in objects:
+                collected.extend(field.reference_ids(obj.__dict__.get(name)))
+
+        loaded = {}
+        for schema, schema_ids in ids.items():
+            if schema_ids:
+                loaded[schema] = dict((text_type(obj._id), obj) for obj in schema.get_many(schema_ids) if obj is not None)
+
+        for name in names:
+            field = fields[name]
+            for obj in objects:
+                raw_document = obj.__dict__
+                if name in raw_document:
+                    raw_document[name] = field.resolve(raw_document[name], loaded.get(field.references, {}))
+
+    @classmethod
+    def iter_find(cls, query=None, limit=None, order_by=None, reverse=False, offset=0, batch_size=100, only=None,
+                  exclude=None):
+        """
+        Iterate over all matching objects.
+        Documents are fetched in chunks of batch_size and objects are created on demand.
+        Results are always sorted by the database (see sort_native of find).
+
+        :param query: Query to match with
+        :param limit: Limit of objects to retrieve
+        :param order_by: Field to order results by
+        :param reverse: Reverse ordering
+        :param offset: Offset
+        :param batch_size: Number of documents to fetch at once
+        :param only: List of fields to retrieve, other fields are loaded on first access
+        :param exclude: List of fields not to retrieve, they are loaded on first access
+        :return: Generator of objects
+        """
+        projection, deferred = cls.__projection(only, exclude)
         database_handle = cls.get_handler()
 
         with database_handle as db:
             collection_name = cls.__name__
             collection = db[collection_name]
 
-            if sort_native:
-                results = collection.find(query, limit, offset, order_by, reverse)
-                results = [cls(__dictionary=document) for document in results]
-            else:
-                results = collection.find(query, limit, offset)
-                results = [cls(__dictionary=document) for document in results]
+            for document in collection.iter_find(query, limit, offset, order_by, reverse, batch_size, projection):
+                obj = cls(__dictionary=document, __deferred=deferred)
+
+                session = current_session()
+                if session is not None:
+                    obj = session.register(obj)
+
+                yield obj
+
+    @classmethod
+    def paginate(cls, query=None, order_by=None, page_size=20, after=None, reverse=False, only=None,
+                 exclude=None):
+        """
+        Get a page of matching objects, continuing after the last object of the previous page.
+        Unlike offset, the position is a range condition on the sort keys and '_id', so deep pages stay fast
+        (given an index on the sort keys).
+
+        :param query: Query to match with
+        :param order_by: Field(s) to order results by, see find; ties are ordered by '_id'
+        :param page_size: Number of objects per page, at least 1
+        :param after: next_token of the previous page, None for the first page
+        :param reverse: Reverse ordering
+        :param only: List of fields to retrieve, other fields are loaded on first access
+        :param exclude: List of fields not to retrieve, they are loaded on first access
+        :return: Page
+        """
+        if page_size < 1:
+            raise ValueError('page_size has to be at least 1, got {0}'.format(page_size))
+
+        sort = []
+        for key, direction in normalize_sort(order_by, reverse):
+            sort.append((key, direction))
+            if key == '_id':
+                break
+
+        if not sort or sort[-1][0] != '_id':
+            sort.append(('_id', sort[-1][1] if sort else (DESCENDING if reverse else ASCENDING)))
+
+        if after is not None:
+            # required fields are never null, which allows range conditions for descending keys
+            fields = dict(cls._fields)
+            nullable = set(key for key, direction in sort
+                           if key != '_id' and (key not in fields or not fields[key].required))
+            position = keyset_query(sort, decode_token(after, len(sort)), nullable)
+            query = {'$and': [query, position]} if query else position
 
-                if order_by is not None:
-                    def deep_sort(d, order_key):
-                        keys = order_key.split('.')
-                        val = d
-                        for key in keys:
-                            val = getattr(val, key)
-                            if val is None:
-                                return None
-                        return val
+        # the sort keys are needed for the next token
+        sort_fields = [key.split('.')[0] for key, direction in sort if key != '_id']
+        if only is not None:
+            only = list(only) + sort_fields
+        if exclude:
+            exclude = [key for key in exclude if key not in sort_fields]
 
-                    results = sorted(results, key=lambda d: deep_sort(d, order_by), reverse=reverse)
+        items = cls.find(query, limit=page_size + 1, order_by=sort, only=only, exclude=exclude)
 
-            return results
+        next_token = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            last = items[-1]
+            document = last.to_dict()
+            document['_id'] = last._id
+            next_token = encode_token([get_value(document, key) for key, direction in sort])
+
+        return Page(items, next_token)
 
     @classmethod
-    def find_one(cls, query=None):
-        result = cls.find(query, limit=1)
+    def find_one(cls, query=None, only=None, exclude=None):
+        session = current_session()
+        if session is not None and isinstance(query, dict) and len(query) == 1 and '_id' in query \
+                and not isinstance(query['_id'], (dict, list)):
+            # lookup by id -> use the identity map
+            obj = session.get(cls, query['_id'])
+            if obj is not None:
+                return obj
+
+        result = cls.find(query, limit=1, only=only, exclude=exclude)
         if len(result) > 0:
             return result[0]
         return None
 
     @classmethod
-    def distinct(cls, key):
+    def get_many(cls, ids, only=None, exclude=None):
+        """
+        Get objects by id with one query
+
+        :param ids: List of ids
+        :param only: List of fields to retrieve, other fields are loaded on first access
+        :param exclude: List of fields not to retrieve, they are loaded on first access
+        :return: List of objects in the order of ids, None for ids that were not found
+        """
+        ids = list(ids)
+        session = current_session()
+        found = {}
+        missing = []
+
+        seen = set()
+
+        for id_ in ids:
+            if id_ is None or text_type(id_) in seen:
+                continue
+            seen.add(text_type(id_))
+
+            obj = session.get(cls, id_) if session is not None else None
+            if obj is not None:
+                found[text_type(id_)] = obj
+            else:
+                missing.append(id_)
+
+        if missing:
+            for obj in cls.find({'_id': {'$in': missing}}, only=only, exclude=exclude):
+                found[text_type(obj._id)] = obj
+
+        return [found.get(text_type(id_)) if id_ is not None else None for id_ in ids]
+
+    @classmethod
+    def __projection(cls, only=None, exclude=None):
+        """
+        Get the projection and the fields left out by it
+
+        :param only: List of fields to retrieve
+        :param exclude: List of fields not to retrieve
+        :return: tuple of projection and set of deferred fields
+        """
+        projection = normalize_projection(only, exclude)
+        if projection is None:
+            return None, None
+
+        if only is not None:
+            deferred = frozenset(k for k, v in cls._fields if k not in projection)
+        else:
+            deferred = frozenset(k for k, v in cls._fields if k in projection)
+
+        return projection, deferred or None
+
+    @classmethod
+    def distinct(cls, key, query=None):
+        """
+        Get all distinct values of a key, evaluated by the database
+
+        :param key: Key to look up
+        :param query: optional query to match with
+        :return: List of distinct values
+        """
         database_handle = cls.get_handler()
         with database_handle as db:
             collection_name = cls.__name__
             collection = db[collection_name]
-            return collection.distinct(key)
+            return collection.distinct(key, query)
+
+    @classmethod
+    def aggregate(cls, match=None, group_by=None, sum=None, avg=None, min=None, max=None, count=False, sort=None,
+                  limit=None):
+        """
+        Aggregate matching documents in the database, e.g. totals per category.
+        Results are plain dictionaries, no objects are created.
+
+        :param match: Query to match with
+        :param group_by: Key or list of keys to group by, all matching documents form one group if not given
+        :param sum: Key, list of keys or dictionary of result name -> key, results are named e.g. 'sum_price'
+        :param avg: see sum
+        :param min: see sum
+        :param max: see sum
+        :param count: Count documents per group, True for a result named 'count' or the result name
+        :param sort: Group key(s) / result name(s) to order by, see find(order_by=...)
+        :param limit: Limit of rows
+        :return: List of dictionaries with the group keys and results
+        """
+        if group_by is None:
+            group_by = []
+        elif not isinstance(group_by, (list, tuple)):
+            group_by = [group_by]
+
+        aggregates = normalize_aggregates(sum, avg, min, max, count)
+        sort = normalize_sort(sort)
+
+        names = set(group_by) | set(name for name, function, key in aggregates)
+        for key, direction in sort:
+            if key not in names:
+                raise ValueError('Can not sort by "{0}", it is no group key or result'.format(key))
+
+        with cls.get_handler() as db:
+            collection_name = cls.__name__
+            collection = db[collection_name]
+            return collection.aggregate(match, list(group_by), aggregates, sort, limit)
 
     @classmethod
     def count(cls, query=None):
+        cache = cls.get_query_cache()
+        key = None
+        if cache is not None:
+            key = make_key('count', query)
+        if key is not None:
+            generation = cache.generation
+            found, result = cache.get(key)
+            if found:
+                return result
+
         database_handle = cls.get_handler()
         with database_handle as db:
             collection_name = cls.__name__
             collection = db[collection_name]
 
-            return collection.count(query)
+            result = collection.count(query)
 
-        return False
+        if key is not None:
+            cache.set(key, result, generation)
+
+        return result
 
     @classmethod
     def drop(cls):
@@ -206,6 +921,8 @@ class Schema:
         with database_handle as db:
             collection_name = cls.__name__
             db.drop_collection(collection_name)
+            cls._invalidate_cache()
+            cls._evict()
 
             return True
 
@@ -222,6 +939,55 @@ class Schema:
 
         return False
 
+    @classmethod
+    def ensure_indexes(cls, background=True):
+        """
+        Create all indexes declared in __indexes__ that do not exist yet.
+        Each index is declared as keys (see create_index) or as a dictionary
+        with 'keys' and further arguments like 'unique' and 'name'.
+        Existing indexes with the same name but other keys or uniqueness are dropped and created again.
+
+        :param background: Build indexes in the background (MongoDB)
+        :return: List of created index names
+        """
+        created = []
+
+        with cls.get_handler() as db:
+            collection_name = cls.__name__
+            collection = db[collection_name]
+            existing = collection.index_information()
+
+            for spec in cls.__indexes__ or []:
+                if isinstance(spec, dict):
+                    options = dict(spec)
+                    keys = options.pop('keys')
+                else:
+                    options = {}
+                    keys = spec
+
+                name = options.pop('name', None) or index_name(keys)
+                expected = {'keys': normalize_index(keys), 'unique': bool(options.get('unique'))}
+                if name in existing:
+                    if existing[name]['unique'] == expected['unique'] and \
+                            index_signature(existing[name]['keys']) == index_signature(expected['keys']):
+                        continue
+                    collection.drop_index(name)
+
+                collection.create_index(keys, name=name, background=background, **options)
+                existing[name] = expected
+                created.append(name)
+
+        return created
+
+    @classmethod
+    def list_indexes(cls):
+        database_handle = cls.get_handler()
+        with database_handle as db:
+            collection_name = cls.__name__
+            collection = db[collection_name]
+
+            return collection.list_indexes()
+
     @classmethod
     def drop_index(cls, name):
         database_handle = cls.get_handler()
@@ -248,3 +1014,28 @@ class Schema:
     @classmethod
     def on_delete(cls, doc):
         pass
+
+
+def ensure_all_indexes(background=True):
+    """
+    Create the declared indexes of all Schema classes, see Schema.ensure_indexes
+
+    :param background: Build indexes in the background (MongoDB)
+    :return: Dictionary of collection name -> list of created index names
+    """
+    created = {}
+    classes = Schema.__subclasses__()
+    visited = set()
+
+    while classes:
+        cls = classes.pop(0)
+        if cls in visited:
+            # reached again through multiple inheritance
+            continue
+        visited.add(cls)
+        classes.extend(cls.__subclasses__())
+
+        if cls.__indexes__:
+            created[cls.__name__] = cls.ensure_indexes(background)
+
+    return created
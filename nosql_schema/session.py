@@ -0,0 +1,150 @@
+"""
+This module contains the Session, a unit of work with an identity map
+"""
+
+import threading
+from .compat import text_type
+from .exceptions import BulkWriteError
+
+_local = threading.local()
+
+
+def current_session():
+    """
+    Get the active Session of the current thread
+
+    :return: Session or None
+    """
+    return getattr(_local, 'session', None)
+
+
+class Session:
+    """
+    Session
+    Keeps one object per (Schema class, _id) and collects objects to save.
+
+    with Session() as session:
+        user = User.find_one({'_id': user_id})   # query
+        user = User.find_one({'_id': user_id})   # same object, no query
+        user.name = 'John Doe'
+        session.add(user)
+    # pending objects are saved on exit, discarded on exceptions
+    """
+
+    def __init__(self):
+        self.identity_map = {}
+        self.pending = []
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = current_session()
+        _local.session = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            _local.session = self._previous
+            self._previous = None
+
+    @staticmethod
+    def _key(cls, id_):
+        return cls, text_type(id_)
+
+    def get(self, cls, id_):
+        """
+        Get a loaded object by id
+
+        :param cls: Schema class
+        :param id_: _id of the object
+        :return: object or None
+        """
+        return self.identity_map.get(self._key(cls, id_))
+
+    def register(self, instance):
+        """
+        Add a loaded object to the identity map.
+        If an object with the same id is already known, that object is kept and returned.
+
+        :param instance: Schema object
+        :return: object of the identity map
+        """
+        if instance._id is None:
+            return instance
+
+        return self.identity_map.setdefault(self._key(instance.__class__, instance._id), instance)
+
+    def evict(self, cls, id_=None):
+        """
+        Remove objects from the identity map
+
+        :param cls: Schema class
+        :param id_: optional _id, all objects of cls are removed if not given
+        """
+        if id_ is not None:
+            self.identity_map.pop(self._key(cls, id_), None)
+            return
+
+        for key in [key for key in self.identity_map if key[0] is cls]:
+            del self.identity_map[key]
+
+    def add(self, instance):
+        """
+        Save an object on commit
+
+        :param instance: Schema object
+        """
+        if not any(instance is item for item in self.pending):
+            self.pending.append(instance)
+
+    def commit(self):
+        """
+        Save all pending objects, one save_all per Schema class.
+        Objects that could not be saved stay pending.
+
+        :raise BulkWriteError: if objects could not be saved, errors holds (object, error) tuples
+        :return: Dictionary of Schema class -> BulkResult
+        """
+        pending, self.pending = self.pending, []
+        by_class = {}
+        order = []
+
+        for instance in pending:
+            cls = instance.__class__
+            if cls not in by_class:
+                by_class[cls] = []
+                order.append(cls)
+            by_class[cls].append(instance)
+
+        results = {}
+        errors = []
+        for cls in order:
+            results[cls] = cls.save_all(by_class[cls])
+            for index, instance in enumerate(by_class[cls]):
+                if index in results[cls].errors:
+                    errors.append((instance, results[cls].errors[index]))
+                    self.pending.append(instance)
+                else:
+                    self.register(instance)
+
+        if errors:
+            raise BulkWriteError('{0} object(s) could not be saved'.format(len(errors)), errors)
+
+        return results
+
+    def rollback(self):
+        """
+        Discard all pending objects
+        """
+        self.pending = []
+
+    def clear(self):
+        """
+        Discard pending objects and the identity map
+        """
+        self.pending = []
+        self.identity_map.clear()
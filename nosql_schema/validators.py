@@ -1,4 +1,8 @@
 import re
+from .compat import integer_types, string_types
+
+NUMBER_TYPES = integer_types + (float,)
+STRING_TYPES = string_types
 
 
 class Validator:
@@ -14,6 +18,22 @@ class Validator:
             return False
         return True
 
+    @classmethod
+    def compile(cls, field):
+        """
+        Compile the check for the given field, see Field.compile.
+        Compiled checks are only called with values that are not None.
+
+        :param field: Field to check values for
+        :return: function(value) -> bool, None if there is nothing to check
+        """
+        if cls is Validator:
+            # only checks for None
+            return None
+
+        validate = cls.validate
+        return lambda value: validate(value=value, field=field)
+
 
 class NumberValidator(Validator):
     @staticmethod
@@ -22,11 +42,15 @@ class NumberValidator(Validator):
         if not field.required and value is None:
             return True
 
-        if type(value) is not int and type(value) is not long and type(value) is not float:
+        if type(value) not in NUMBER_TYPES:
             return False
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        return lambda value: type(value) in NUMBER_TYPES
+
 
 class StringValidator(Validator):
     @staticmethod
@@ -35,11 +59,15 @@ class StringValidator(Validator):
         if not field.required and value is None:
             return True
 
-        if type(value) is not str and type(value) is not unicode:
+        if type(value) not in STRING_TYPES:
             return False
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        return lambda value: type(value) in STRING_TYPES
+
 
 class MinValidator(Validator):
     @staticmethod
@@ -53,6 +81,13 @@ class MinValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        minimum = field.min
+        if not minimum:
+            return None
+        return lambda value: not value < minimum
+
 
 class MaxValidator(Validator):
     @staticmethod
@@ -66,6 +101,13 @@ class MaxValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        maximum = field.max
+        if not maximum:
+            return None
+        return lambda value: not value > maximum
+
 
 class RangeValidator(Validator):
     @staticmethod
@@ -79,6 +121,13 @@ class RangeValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        allowed = field.range
+        if not allowed:
+            return None
+        return lambda value: value in allowed
+
 
 class StringMinValidator(Validator):
     @staticmethod
@@ -92,6 +141,13 @@ class StringMinValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        minimum = field.min
+        if not minimum:
+            return None
+        return lambda value: not len(value) < minimum
+
 
 class StringMaxValidator(Validator):
     @staticmethod
@@ -105,6 +161,13 @@ class StringMaxValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        maximum = field.max
+        if not maximum:
+            return None
+        return lambda value: not len(value) > maximum
+
 
 class RegexpValidator(Validator):
     @staticmethod
@@ -120,6 +183,16 @@ class RegexpValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        if not field.regexp:
+            return None
+
+        match = re.compile(field.regexp).match
+        if field.required:
+            return lambda value: match(value) is not None
+        return lambda value: value == '' or match(value) is not None
+
 
 class ChoiceValidator(Validator):
     @staticmethod
@@ -133,6 +206,13 @@ class ChoiceValidator(Validator):
 
         return True
 
+    @classmethod
+    def compile(cls, field):
+        choices = field.choices
+        if not choices:
+            return None
+        return lambda value: value in choices
+
 
 class DictValidator(Validator):
     @staticmethod
@@ -145,7 +225,7 @@ class DictValidator(Validator):
             return False
 
         if field.allowed_fields:
-            for k,v in field.allowed_fields.iteritems():
+            for k,v in field.allowed_fields.items():
                 if k in value and value[k] is not None and not v.validate(value=value[k]):
                     return False
 
@@ -172,6 +252,11 @@ class ListValidator(Validator):
                 if not isinstance(item, field.allowed_type):
                     return False
 
+        if getattr(field, 'field', None) is not None:
+            for item in value:
+                if not field.field.validate(value=item):
+                    return False
+
         if field.custom_type:
             # Use custom type to check objects for key, value
             for item in value:
@@ -179,7 +264,7 @@ class ListValidator(Validator):
                 if not isinstance(item, dict):
                     temp = item.__dict__
 
-                for key, value in temp.iteritems():
+                for key, value in temp.items():
                     try:
                         if not isinstance(value, field.custom_type[key]):
                             return False
@@ -187,3 +272,17 @@ class ListValidator(Validator):
                         return False
 
         return True
+
+
+class ReferenceValidator(Validator):
+    @staticmethod
+    def validate(value=None, field=None):
+        # skip all tests if not required and not defined
+        if not field.required and value is None:
+            return True
+
+        if isinstance(value, field.references):
+            # referenced objects have to be saved first
+            return value._id is not None
+
+        return value is not None and not isinstance(value, (dict, list, float))
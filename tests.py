@@ -1,6 +1,18 @@
 import unittest
 import os
-from nosql_schema import fields, schema, exceptions
+import json
+import sys
+import sqlite3
+import nosql_schema
+from nosql_schema import fields, schema, exceptions, compat
+from nosql_schema.db import nosqlite
+from nosql_schema.db.nosqlite import sql
+from nosql_schema.db import query as db_query
+from nosql_schema.cache import make_key
+from nosql_schema.db import mongodb
+from bson.objectid import ObjectId
+from bson.son import SON
+from pymongo import UpdateOne
 
 # Configure database
 schema.Schema.__config__ = {
@@ -30,7 +42,8 @@ class TestFields(unittest.TestCase):
 
         # long
         field = fields.NumberField()
-        self.assertTrue(field.validate(value=long(1)))
+        for integer_type in compat.integer_types:
+            self.assertTrue(field.validate(value=integer_type(1)))
 
         # other
         field = fields.NumberField()
@@ -128,6 +141,22 @@ class TestFields(unittest.TestCase):
         self.assertTrue(field.validate(value=['foo']))
 
 
+    def test_compile(self):
+        field = fields.NumberField(min=10)
+        self.assertFalse(field.validate(value=5))
+
+        # changed constraints are compiled on the next validation
+        field.min = 1
+        self.assertIsNone(field._validate)
+        self.assertTrue(field.validate(value=5))
+        self.assertIsNotNone(field._validate)
+
+        field = fields.StringField(required=False, regexp=r'^a')
+        self.assertTrue(field.validate(value=''))
+        self.assertTrue(field.validate(value=None))
+        self.assertFalse(field.validate(value='b'))
+
+
 class TestNoSQLSchema(unittest.TestCase):
     class MyTestSchema(schema.Schema):
         name = fields.StringField()
@@ -166,7 +195,817 @@ class TestNoSQLSchema(unittest.TestCase):
 
         self.assertTrue(TestNoSQLSchema.MyTestSchema.count() == 0)
 
+    def test_connection_pool(self):
+        handler = TestNoSQLSchema.MyTestSchema.get_handler()
+        stats = handler.pool.stats()
+
+        with handler as db:
+            connection = db.connection
+            with handler as nested_db:
+                # nested blocks share the thread's connection
+                self.assertIs(nested_db.connection, connection)
+
+        self.assertIsNone(handler.connection)
+
+        with handler as db:
+            # connection is reused
+            self.assertIs(db.connection, connection)
+
+        self.assertEqual(handler.pool.stats()['misses'], stats['misses'] + 1)
+        self.assertEqual(handler.pool.stats()['hits'], stats['hits'] + 1)
+
+    def test_client_registry(self):
+        from nosql_schema.db.mongodb import client_registry, DatabaseHandler
+
+        client = client_registry.get_client('localhost', 27017, connect=False)
+        self.assertIs(client_registry.get_client('localhost', '27017', connect=False), client)
+        self.assertIsNot(client_registry.get_client('localhost', 27017, connect=False, max_pool_size=5), client)
+
+        # cached handlers pick up replaced clients on connect
+        handler = DatabaseHandler(port=27017, connect=False)
+        with handler:
+            self.assertIs(handler.client, client)
+
+        client_registry.shutdown()
+        with handler:
+            self.assertIsNot(handler.client, client)
+        client = handler.client
+
+        # forked process
+        client_registry._pid = -1
+        with handler:
+            self.assertIsNot(handler.client, client)
+        client = handler.client
+
+        client_registry.reset_after_fork()
+        with handler:
+            self.assertIsNot(handler.client, client)
+
+        client_registry.shutdown()
+
+    def test_handler_cache(self):
+        class OtherSchema(TestNoSQLSchema.MyTestSchema):
+            pass
+
+        handler = OtherSchema.get_handler()
+        self.assertIs(OtherSchema.get_handler(), handler)
+
+        # changed config -> new handler
+        OtherSchema.__config__ = dict(schema.Schema.__config__, pool_size=2)
+        other_handler = OtherSchema.get_handler()
+        self.assertIsNot(other_handler, handler)
+        self.assertIs(OtherSchema.get_handler(), other_handler)
+
+        OtherSchema.__config__['pool_size'] = 3
+        self.assertIsNot(OtherSchema.get_handler(), other_handler)
+
+    def test_fields_table(self):
+        class ExtendedSchema(TestNoSQLSchema.MyTestSchema):
+            age = fields.NumberField(required=False)
+            name = fields.StringField(default='John Doe')
+
+        self.assertEqual([k for k, v in TestNoSQLSchema.MyTestSchema._fields], ['name', 'email'])
+        # inherited fields first, overridden fields keep their position
+        self.assertEqual([k for k, v in ExtendedSchema._fields], ['name', 'email', 'age'])
+
+        obj = ExtendedSchema(email='john.doe@example.com')
+        self.assertEqual(obj.to_dict(), {'name': 'John Doe', 'email': 'john.doe@example.com', 'age': None})
+
+    def test_save_all(self):
+        objects = [TestNoSQLSchema.MyTestSchema(name='John Doe %d' % i, email='john.doe@example.com')
+                   for i in range(5)]
+        objects.insert(2, TestNoSQLSchema.MyTestSchema(name='John Doe', email='john'))
+
+        result = TestNoSQLSchema.MyTestSchema.save_all(objects, batch_size=2)
+
+        self.assertFalse(result.success)
+        self.assertEqual(list(result.errors.keys()), [2])
+        self.assertIsNone(result.ids[2])
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.count(), 5)
+
+        for obj, id_ in zip(objects, result.ids):
+            self.assertEqual(obj._id, id_)
+            if id_ is not None:
+                self.assertEqual(TestNoSQLSchema.MyTestSchema.find_one({'_id': id_}).name, obj.name)
+
+        # existing objects are updated
+        objects[0].name = 'Jane Doe'
+        result = TestNoSQLSchema.MyTestSchema.save_all(objects[:2])
+        self.assertTrue(result.success)
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.count(), 5)
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.find_one({'_id': objects[0]._id}).name, 'Jane Doe')
+
+
+    @unittest.skipIf(not hasattr(sqlite3.Connection, 'set_trace_callback'), 'statement tracing requires Python 3.3+')
+    def test_save_all_updates(self):
+        objects = [TestNoSQLSchema.MyTestSchema(name='John Doe %d' % i, email='john.doe@example.com')
+                   for i in range(5)]
+        TestNoSQLSchema.MyTestSchema.save_all(objects)
+
+        # loaded objects are updated within one transaction
+        loaded = TestNoSQLSchema.MyTestSchema.find()
+        for obj in loaded:
+            obj.name = 'Max Doe'
+        statements = []
+        with TestNoSQLSchema.MyTestSchema.get_handler() as db:
+            collection = db[TestNoSQLSchema.MyTestSchema.__name__]
+            collection.collection_handle.db.set_trace_callback(statements.append)
+            try:
+                self.assertTrue(TestNoSQLSchema.MyTestSchema.save_all(loaded).success)
+            finally:
+                collection.collection_handle.db.set_trace_callback(None)
+        # getting the collection creates its table if missing
+        keywords = [statement.split()[0].lower() for statement in statements]
+        self.assertEqual([keyword for keyword in keywords if keyword != 'create'],
+                         ['begin'] + ['update'] * 5 + ['commit'])
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.count({'name': 'Max Doe'}), 5)
+
+    def test_iter_find(self):
+        objects = [TestNoSQLSchema.MyTestSchema(name='John Doe %d' % i, email='john.doe@example.com')
+                   for i in range(10)]
+        TestNoSQLSchema.MyTestSchema.save_all(objects)
+
+        results = TestNoSQLSchema.MyTestSchema.iter_find(batch_size=3)
+        self.assertNotIsInstance(results, list)
+        self.assertEqual([obj.name for obj in results], [obj.name for obj in objects])
+
+        results = TestNoSQLSchema.MyTestSchema.iter_find({'name': {'$ne': 'John Doe 0'}}, limit=4, offset=2,
+                                                         batch_size=3)
+        self.assertEqual([obj._id for obj in results], [obj._id for obj in objects[3:7]])
+
+    def test_find_paging(self):
+        objects = [TestNoSQLSchema.MyTestSchema(name='John Doe %02d' % (i % 7), email='john.doe@example.com')
+                   for i in range(50)]
+        TestNoSQLSchema.MyTestSchema.save_all(objects)
+
+        # limit and offset combined
+        result = TestNoSQLSchema.MyTestSchema.find(limit=2, offset=3)
+        self.assertEqual([obj._id for obj in result], [obj._id for obj in objects[3:5]])
+
+        # deep page, ordered by the database, ties ordered by id
+        expected = sorted(objects, key=lambda obj: (obj.name, obj._id), reverse=True)[40:45]
+        result = TestNoSQLSchema.MyTestSchema.find(limit=5, offset=40, order_by='name', reverse=True,
+                                                   sort_native=True)
+        self.assertEqual([obj._id for obj in result], [obj._id for obj in expected])
+
+        # pages are always selected in sort order
+        result = TestNoSQLSchema.MyTestSchema.find(limit=5, offset=40, order_by='name', reverse=True)
+        self.assertEqual([obj._id for obj in result], [obj._id for obj in expected])
+
+        # filtered deep page
+        expected = [obj for obj in objects if obj.name != 'John Doe 03'][30:35]
+        result = TestNoSQLSchema.MyTestSchema.find({'name': {'$ne': 'John Doe 03'}}, limit=5, offset=30)
+        self.assertEqual([obj._id for obj in result], [obj._id for obj in expected])
+
+        # compound keys
+        expected = sorted(objects, key=lambda obj: (obj.name, -obj._id))[:5]
+        result = TestNoSQLSchema.MyTestSchema.find(limit=5, order_by=['name', ('_id', -1)])
+        self.assertEqual([obj._id for obj in result], [obj._id for obj in expected])
+
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.find(offset=50), [])
+
+        # sorted by the database without limit too, objects without the key come first
+        with TestNoSQLSchema.MyTestSchema.get_handler() as db:
+            db['MyTestSchema'].insert({'email': 'jane.doe@example.com'})
+        result = TestNoSQLSchema.MyTestSchema.find(order_by='name')
+        self.assertEqual([obj.name for obj in result[:2]], [None, 'John Doe 00'])
+        self.assertEqual(len(result), 51)
+
+    def test_projection(self):
+        obj = TestNoSQLSchema.MyTestSchema(name='John Doe', email='john.doe@example.com')
+        obj.save()
+
+        obj = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id}, only=['name'])
+        self.assertEqual(obj.__dict__.get('name'), 'John Doe')
+        self.assertNotIn('email', obj.__dict__)
+
+        # missing fields are loaded on access
+        self.assertEqual(obj.email, 'john.doe@example.com')
+        self.assertEqual(obj.__dict__.get('email'), 'john.doe@example.com')
+
+        obj = TestNoSQLSchema.MyTestSchema.find(exclude=['name'])[0]
+        self.assertNotIn('name', obj.__dict__)
+        self.assertEqual(obj.__dict__.get('email'), 'john.doe@example.com')
+
+        # partially loaded objects are completed before saving
+        obj.email = 'jane.doe@example.com'
+        obj.save()
+        obj = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id})
+        self.assertEqual(obj.to_dict(), {'_id': obj._id, 'name': 'John Doe', 'email': 'jane.doe@example.com'})
+
+        self.assertEqual([o.name for o in TestNoSQLSchema.MyTestSchema.iter_find(only=['name'])], ['John Doe'])
+
+        # also when saved in batches or by a Session
+        obj = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id}, only=['name'])
+        obj.name = 'Jane Doe'
+        self.assertTrue(TestNoSQLSchema.MyTestSchema.save_all([obj]).success)
+        obj = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id})
+        self.assertEqual(obj.to_dict(), {'_id': obj._id, 'name': 'Jane Doe', 'email': 'jane.doe@example.com'})
+
+        with nosql_schema.Session() as session:
+            obj = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id}, only=['email'])
+            obj.email = 'max@example.com'
+            session.add(obj)
+        obj = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id})
+        self.assertEqual(obj.to_dict(), {'_id': obj._id, 'name': 'Jane Doe', 'email': 'max@example.com'})
+
+    def test_partial_update(self):
+        class CountingSchema(TestNoSQLSchema.MyTestSchema):
+            tags = fields.ListField(required=False)
+            updates = 0
+
+            @classmethod
+            def on_update(cls, doc):
+                cls.updates += 1
+
+        obj = CountingSchema(name='John Doe', email='john.doe@example.com', tags=['foo'])
+        obj.save()
+
+        # nothing changed -> no write
+        obj.save()
+        self.assertEqual(CountingSchema.updates, 0)
+
+        # only changed fields are written
+        other = CountingSchema.find_one({'_id': obj._id})
+        other.email = 'jane.doe@example.com'
+        other.save()
+        self.assertEqual(CountingSchema.updates, 1)
+
+        obj.name = 'Jane Doe'
+        obj.tags.append('bar')
+        obj.save()
+        self.assertEqual(CountingSchema.updates, 2)
+
+        obj = CountingSchema.find_one({'_id': obj._id})
+        self.assertEqual(obj.to_dict(), {'_id': obj._id, 'name': 'Jane Doe', 'email': 'jane.doe@example.com',
+                                         'tags': ['foo', 'bar']})
+
+        # changes of on_update are written
+        class StampedSchema(TestNoSQLSchema.MyTestSchema):
+            updated = fields.NumberField(required=False)
+
+            @classmethod
+            def on_update(cls, doc):
+                doc['updated'] = 42
+
+        obj = StampedSchema(name='John Doe', email='john.doe@example.com')
+        obj.save()
+        obj.name = 'Jane Doe'
+        obj.save()
+        self.assertEqual(StampedSchema.find_one({'_id': obj._id}).updated, 42)
+
+        other = StampedSchema(name='Max Mustermann', email='max@example.com')
+        other.save()
+        other.name = 'Erika Mustermann'
+        StampedSchema.save_all([other])
+        self.assertEqual(StampedSchema.find_one({'_id': other._id}).updated, 42)
+
+    def test_update_many(self):
+        class CounterSchema(TestNoSQLSchema.MyTestSchema):
+            visits = fields.NumberField(default=0)
+
+        objects = [CounterSchema(name='John Doe %d' % i, email='john.doe@example.com') for i in range(5)]
+        CounterSchema.save_all(objects)
+
+        count = CounterSchema.update_many({'name': {'$in': ['John Doe 1', 'John Doe 2']}},
+                                          {'$inc': {'visits': 2}, '$set': {'email': 'jane.doe@example.com'}})
+        self.assertEqual(count, 2)
+        self.assertEqual([obj.visits for obj in CounterSchema.find()], [0, 2, 2, 0, 0])
+        self.assertEqual(CounterSchema.count({'email': 'jane.doe@example.com'}), 2)
+
+        # values are validated up front
+        self.assertRaises(exceptions.ValidationError, CounterSchema.update_many, {}, {'$set': {'email': 'jane'}})
+        self.assertRaises(exceptions.ValidationError, CounterSchema.update_many, {}, {'$inc': {'name': 1}})
+        self.assertRaises(exceptions.ValidationError, CounterSchema.update_many, {}, {'$inc': {'visits': '1'}})
+        self.assertRaises(exceptions.ValidationError, CounterSchema.update_many, {}, {'$unset': ['name']})
+        self.assertRaises(exceptions.ValidationError, CounterSchema.update_many, {}, {'$push': {'visits': 1}})
+
+        obj = objects[1]
+        self.assertEqual(obj.increment('visits'), 1)
+        self.assertEqual(CounterSchema.find_one({'_id': obj._id}).visits, 3)
+
+        # increments are not overwritten by saving
+        obj.name = 'Jane Doe'
+        obj.save()
+        self.assertEqual(CounterSchema.find_one({'_id': obj._id}).visits, 3)
+
+        # fields left out by a projection are loaded after the increment
+        partial = CounterSchema.find_one({'_id': obj._id}, only=['name'])
+        self.assertEqual(partial.increment('visits', 2), 5)
+        self.assertEqual(partial.visits, 5)
+        partial.name = 'John Doe'
+        partial.save()
+        self.assertEqual(CounterSchema.find_one({'_id': obj._id}).visits, 5)
+
+    def test_delete_many(self):
+        class DeletingSchema(TestNoSQLSchema.MyTestSchema):
+            deleted = []
+
+            @classmethod
+            def on_delete(cls, doc):
+                cls.deleted.append(doc['name'])
+
+        objects = [DeletingSchema(name='John Doe %d' % i, email='john.doe@example.com') for i in range(5)]
+        DeletingSchema.save_all(objects)
+
+        self.assertEqual(DeletingSchema.delete_many({'name': {'$in': ['John Doe 1', 'John Doe 3']}}), 2)
+        self.assertEqual(DeletingSchema.deleted, [])
+        self.assertEqual([obj.name for obj in DeletingSchema.find()], ['John Doe 0', 'John Doe 2', 'John Doe 4'])
+
+        self.assertEqual(DeletingSchema.delete_many({'name': 'John Doe 0'}, hooks=True), 1)
+        self.assertEqual(DeletingSchema.deleted, ['John Doe 0'])
+
+        self.assertEqual(DeletingSchema.delete_many(), 2)
+        self.assertEqual(DeletingSchema.count(), 0)
+
+    def test_indexes(self):
+        cls = TestNoSQLSchema.MyTestSchema
+
+        self.assertEqual(cls.create_index('email', unique=True), 'email_1')
+        self.assertEqual(cls.create_index([('name', 1), ('email', -1)], name='name_email'), 'name_email')
+        self.assertEqual(sorted(cls.list_indexes()), ['_id_', 'email_1', 'name_email'])
+
+        cls(name='John Doe', email='john.doe@example.com').save()
+        self.assertRaises(sqlite3.IntegrityError, cls(name='John Doe', email='john.doe@example.com').save)
+
+        # only the duplicate of a batch fails
+        objects = [cls(name='Jane Doe', email='jane.doe@example.com'),
+                   cls(name='John Doe', email='john.doe@example.com'),
+                   cls(name='Max Doe', email='max.doe@example.com')]
+        result = cls.save_all(objects)
+        self.assertEqual(list(result.errors.keys()), [1])
+        self.assertIsInstance(result.errors[1], sqlite3.IntegrityError)
+        self.assertEqual(result.ids, [objects[0]._id, None, objects[2]._id])
+        self.assertEqual(cls.find_one({'_id': objects[2]._id}).name, 'Max Doe')
+        self.assertEqual(cls.count(), 3)
+
+        # equality conditions use the index
+        with cls.get_handler() as db:
+            collection = db[cls.__name__]
+            where, params = collection._where({'email': 'john.doe@example.com'})
+            plan = db.connection.db.execute('explain query plan select id from %s%s' % (cls.__name__, where),
+                                            params).fetchall()
+            self.assertIn('email_1', str(plan))
+
+        self.assertEqual(cls.find_one({'email': 'john.doe@example.com'}).name, 'John Doe')
+
+        cls.drop_index('email_1')
+        self.assertEqual(sorted(cls.list_indexes()), ['_id_', 'name_email'])
+
+    def test_ensure_indexes(self):
+        class IndexedSchema(TestNoSQLSchema.MyTestSchema):
+            __indexes__ = [
+                'name',
+                {'keys': [('email', -1)], 'unique': True, 'name': 'unique_email'},
+            ]
+
+        IndexedSchema.create_index('name')
+        self.assertEqual(IndexedSchema.ensure_indexes(), ['unique_email'])
+        self.assertEqual(sorted(IndexedSchema.list_indexes()), ['_id_', 'name_1', 'unique_email'])
+
+        self.assertEqual(nosql_schema.ensure_all_indexes().get('IndexedSchema'), [])
+
+        statement = sql.index_statement('t', 'i', [('author.first-name', -1), '_id', 'identifier'])
+        self.assertEqual(sql.index_keys(statement), [('author.first-name', -1), ('_id', 1), ('identifier', 1)])
+
+        # indexes with other keys or uniqueness are created again
+        IndexedSchema.drop_index('unique_email')
+        IndexedSchema.create_index('email', name='unique_email')
+        self.assertEqual(IndexedSchema.ensure_indexes(), ['unique_email'])
+        with IndexedSchema.get_handler() as db:
+            self.assertEqual(db[IndexedSchema.__name__].index_information()['unique_email'],
+                             {'keys': [('email', -1)], 'unique': True})
+        self.assertEqual(IndexedSchema.ensure_indexes(), [])
+
+        # classes reached twice through multiple inheritance are ensured once
+        class LeftSchema(IndexedSchema):
+            pass
+
+        class RightSchema(IndexedSchema):
+            pass
+
+        class DiamondSchema(LeftSchema, RightSchema):
+            pass
+
+        self.assertEqual(nosql_schema.ensure_all_indexes().get('DiamondSchema'), ['name_1', 'unique_email'])
+
+    def test_query_cache(self):
+        class CachedSchema(TestNoSQLSchema.MyTestSchema):
+            __cache__ = {'size': 2, 'ttl': 60}
+
+        cache = CachedSchema.get_query_cache()
+        obj = CachedSchema(name='John Doe', email='john.doe@example.com')
+        obj.save()
+
+        self.assertEqual(CachedSchema.find_one({'name': 'John Doe'}).name, 'John Doe')
+        self.assertEqual(CachedSchema.count(), 1)
+
+        # cached results are copies
+        cached = CachedSchema.find_one({'name': 'John Doe'})
+        cached.name = 'Jane Doe'
+        self.assertEqual(CachedSchema.find_one({'name': 'John Doe'}).name, 'John Doe')
+        self.assertEqual(cache.stats()['hits'], 2)
+
+        # writes of the class invalidate the cache
+        with CachedSchema.get_handler() as db:
+            db[CachedSchema.__name__].delete_many()
+        self.assertEqual(CachedSchema.count(), 1)
+        CachedSchema.update_many({}, {'$set': {'name': 'John Doe'}})
+        self.assertEqual(CachedSchema.count(), 0)
+        self.assertEqual(CachedSchema.count({'name': 'John Doe'}), 0)
+
+        # least recently used results are evicted
+        CachedSchema.count({'name': 'Jane Doe'})
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['entries'], 2)
+
+        # results read before a concurrent write are not cached
+        handler = CachedSchema.get_handler()
+
+        class WritingHandler(object):
+            def __enter__(self):
+                return handler.__enter__()
+
+            def __exit__(self, *args):
+                handler.__exit__(*args)
+                CachedSchema._invalidate_cache()
+
+        CachedSchema.get_handler = classmethod(lambda cls: WritingHandler())
+        try:
+            CachedSchema.count({'name': 'Max Mustermann'})
+            CachedSchema.find({'name': 'Max Mustermann'})
+        finally:
+            del CachedSchema.get_handler
+        self.assertEqual(cache.stats()['entries'], 0)
+
+        # ids are part of the key, values without a stable encoding are not cached
+        obj = CachedSchema(name='John Doe', email='john.doe@example.com')
+        obj.save()
+        self.assertEqual(CachedSchema.count({'_id': nosql_schema.SchemaId(obj._id)}), 1)
+        self.assertEqual(CachedSchema.count({'_id': nosql_schema.SchemaId(obj._id + 1000)}), 0)
+        self.assertIsNone(make_key('count', {'name': object()}))
+
+        # disabled by default
+        self.assertIsNone(TestNoSQLSchema.MyTestSchema.get_query_cache())
+
+    def test_session(self):
+        obj = TestNoSQLSchema.MyTestSchema(name='John Doe', email='john.doe@example.com')
+        obj.save()
+
+        with nosql_schema.Session() as session:
+            first = TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id})
+            self.assertIsNot(first, obj)
+
+            self.assertIs(TestNoSQLSchema.MyTestSchema.find()[0], first)
+
+            # no query for known ids
+            with TestNoSQLSchema.MyTestSchema.get_handler() as db:
+                db[TestNoSQLSchema.MyTestSchema.__name__].delete_many()
+            self.assertIs(TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id}), first)
+            self.assertEqual(TestNoSQLSchema.MyTestSchema.count(), 0)
+
+            # writes through the class evict its objects
+            TestNoSQLSchema.MyTestSchema.delete_many()
+            self.assertIsNone(TestNoSQLSchema.MyTestSchema.find_one({'_id': obj._id}))
+            first._id = None
+
+            first.name = 'Jane Doe'
+            session.add(first)
+            second = TestNoSQLSchema.MyTestSchema(name='Max Mustermann', email='max@example.com')
+            session.add(second)
+            self.assertIsNone(second._id)
+
+        # saved on exit
+        self.assertIsNotNone(second._id)
+        self.assertEqual(sorted(o.name for o in TestNoSQLSchema.MyTestSchema.find()), ['Jane Doe', 'Max Mustermann'])
+        self.assertIsNot(TestNoSQLSchema.MyTestSchema.find_one({'_id': second._id}), second)
+
+        # failed objects are reported and stay pending
+        invalid = TestNoSQLSchema.MyTestSchema(name='Invalid', email='invalid')
+        valid = TestNoSQLSchema.MyTestSchema(name='Erika Mustermann', email='erika@example.com')
+        try:
+            with nosql_schema.Session() as session:
+                session.add(invalid)
+                session.add(valid)
+            self.fail('BulkWriteError not raised')
+        except exceptions.BulkWriteError as e:
+            self.assertEqual([item for item, error in e.errors], [invalid])
+            self.assertIsInstance(e.errors[0][1], exceptions.ValidationError)
+        self.assertEqual(session.pending, [invalid])
+        self.assertIs(session.get(TestNoSQLSchema.MyTestSchema, valid._id), valid)
+        self.assertIsNone(invalid._id)
+        valid.delete()
+
+        # discarded on errors
+        try:
+            with nosql_schema.Session() as session:
+                session.add(TestNoSQLSchema.MyTestSchema(name='Erika Mustermann', email='erika@example.com'))
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.count(), 2)
+
+    def test_get_many(self):
+        objects = [TestNoSQLSchema.MyTestSchema(name='Name %d' % i, email='mail%d@example.com' % i) for i in range(3)]
+        ids = TestNoSQLSchema.MyTestSchema.save_all(objects).ids
+
+        result = TestNoSQLSchema.MyTestSchema.get_many([ids[2], 999, str(ids[0]), None])
+        self.assertEqual([o.name if o else None for o in result], ['Name 2', None, 'Name 0', None])
+        self.assertEqual(TestNoSQLSchema.MyTestSchema.get_many([]), [])
+
+        # one IN condition instead of a query per id
+        self.assertEqual(sql.where_clause({'_id': {'$in': [1, 2]}}), (['id in (?, ?)'], [1, 2], {}))
+        self.assertEqual(sql.where_clause({'_id': {'$in': []}}), (['0'], [], {}))
+
+        with nosql_schema.Session():
+            first = TestNoSQLSchema.MyTestSchema.find_one({'_id': ids[1]})
+            self.assertIs(TestNoSQLSchema.MyTestSchema.get_many([ids[0], ids[1]])[1], first)
+
+    def test_references(self):
+        class Author(nosql_schema.Schema):
+            name = fields.StringField()
+
+        class Book(nosql_schema.Schema):
+            title = fields.StringField()
+            author = fields.ReferenceField(Author)
+            reviewers = fields.ListField(fields.ReferenceField(Author), required=False)
+
+        authors = [Author(name='Author %d' % i) for i in range(3)]
+        Author.save_all(authors)
+
+        book = Book(title='Book', author=authors[0], reviewers=[authors[1], authors[2]])
+        self.assertTrue(book.save())
+        self.assertEqual(book.to_dict()['author'], authors[0]._id)
+        self.assertEqual(book.to_dict()['reviewers'], [authors[1]._id, authors[2]._id])
+        Book(title='Other Book', author=authors[1]._id).save()
+
+        # unsaved objects can not be referenced
+        self.assertRaises(exceptions.ValidationError, Book(title='Invalid', author=Author(name='New')).save)
+
+        # lazy loading
+        loaded = Book.find_one({'title': 'Book'})
+        self.assertEqual(loaded.__dict__['author'], authors[0]._id)
+        self.assertEqual(loaded.author.name, 'Author 0')
+        self.assertEqual([a.name for a in loaded.reviewers], ['Author 1', 'Author 2'])
+        self.assertEqual(loaded.save(), loaded._id)
+
+        # prefetch loads the references of all results at once
+        books = Book.find(order_by='title', prefetch=['author', 'reviewers'])
+        self.assertEqual([b.__dict__['author'].name for b in books], ['Author 0', 'Author 1'])
+        self.assertEqual(books[0].__dict__['reviewers'][1].name, 'Author 2')
+        self.assertIsNone(books[1].reviewers)
+        self.assertRaises(ValueError, Book.find, prefetch=['title'])
+
+        # referenced objects are stored as ids by update_many
+        self.assertEqual(Book.update_many({'title': 'Other Book'}, {'$set': {'author': authors[2],
+                                                                            'reviewers': [authors[0]]}}), 1)
+        other = Book.find_one({'title': 'Other Book'})
+        self.assertEqual(other.__dict__['author'], authors[2]._id)
+        self.assertEqual(other.to_dict()['reviewers'], [authors[0]._id])
+
+        Author.drop()
+        Book.drop()
+
+    def test_convert_ids(self):
+        convert_ids = nosqlite.CollectionHandler.convert_ids
+
+        # queries without ids are not copied
+        names = ['name %d' % i for i in range(100)]
+        query = {'name': {'$in': names}, 'age': {'$gt': 18}}
+        self.assertIs(convert_ids(query), query)
+
+        query = {'_id': {'$in': ['1', 2]}, 'name': {'$in': names},
+                 '$or': [{'_id': '3'}, {'name': 'John Doe'}], 'author': nosql_schema.SchemaId('4')}
+        converted = convert_ids(query)
+        self.assertEqual(converted, {'_id': {'$in': [1, 2]}, 'name': {'$in': names},
+                                     '$or': [{'_id': 3}, {'name': 'John Doe'}], 'author': 4})
+        self.assertIs(converted['name'], query['name'])
+        self.assertEqual(query['_id'], {'$in': ['1', 2]})
+
+        # queries of the same shape reuse the compiled plan
+        plans = len(db_query._plans)
+        converted = convert_ids({'_id': {'$in': ['5']}, 'name': {'$in': []},
+                                 '$or': [{'_id': '6'}, {'name': 'Jane Doe'}], 'author': nosql_schema.SchemaId(7)})
+        self.assertEqual(converted['_id'], {'$in': [5]})
+        self.assertEqual(converted['$or'][0], {'_id': 6})
+        self.assertEqual(len(db_query._plans), plans)
+
+        self.assertEqual(convert_ids({'_id': '8'}), {'_id': 8})
+        self.assertEqual(convert_ids(None), {})
+
+    def test_where_clause(self):
+        self.assertEqual(sql.where_clause({'author.name': 'John Doe', 'age': {'$gte': 18, '$lt': 65}}),
+                         (["json_extract(data, '$.age') >= ?", "json_extract(data, '$.age') < ?",
+                           "json_extract(data, '$.author.name') = ?"], [18, 65, 'John Doe'], {}))
+        self.assertEqual(sql.where_clause({'$or': [{'name': None}, {'email': {'$exists': False}}]}),
+                         (["((json_extract(data, '$.name') is null) or (json_type(data, '$.email') is null))"],
+                          [], {}))
+
+        import warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            conditions, params, remaining = sql.where_clause({'name': 'John Doe', 'tags': {'$all': ['a']}})
+        self.assertEqual((conditions, params), (["json_extract(data, '$.name') = ?"], ['John Doe']))
+        self.assertEqual(remaining, {'tags': {'$all': ['a']}})
+        self.assertEqual(len(caught), 1)
+
+        class OptionalNameSchema(nosql_schema.Schema):
+            name = fields.StringField(required=False)
+            email = fields.EmailField()
+
+        objects = [OptionalNameSchema(name='John Doe %d' % i, email='mail%d@example.com' % i) for i in range(4)]
+        objects.append(OptionalNameSchema(email='mail4@example.com'))
+        OptionalNameSchema.save_all(objects)
+
+        def names(query):
+            return sorted((o.name for o in OptionalNameSchema.find(query)), key=lambda name: (name is not None, name))
+
+        self.assertEqual(names({'name': {'$gt': 'John Doe 2'}}), ['John Doe 3'])
+        self.assertEqual(names({'name': {'$ne': 'John Doe 0', '$nin': ['John Doe 1', 'John Doe 2']}}),
+                         [None, 'John Doe 3'])
+        self.assertEqual(names({'name': {'$in': ['John Doe 1', None]}}), [None, 'John Doe 1'])
+        self.assertEqual(names({'$nor': [{'name': 'John Doe 0'}, {'email': 'mail1@example.com'}]}),
+                         [None, 'John Doe 2', 'John Doe 3'])
+        self.assertEqual(names({'$and': [{'name': {'$exists': True}}, {'$or': [{'name': 'John Doe 1'},
+                                                                                  {'email': 'mail2@example.com'}]}]}),
+                         ['John Doe 1', 'John Doe 2'])
+        self.assertEqual(names({'$not': {'name': {'$lte': 'John Doe 2'}}}), [None, 'John Doe 3'])
+        OptionalNameSchema.drop()
+
+    def test_count_distinct(self):
+        class TaggedSchema(nosql_schema.Schema):
+            name = fields.StringField()
+            tags = fields.ListField(required=False)
+            active = fields.BooleanField(required=False)
+
+        TaggedSchema.save_all([
+            TaggedSchema(name='John Doe', tags=['a', 'b'], active=True),
+            TaggedSchema(name='Jane Doe', tags=['b', 'c', {'name': 'd'}], active=False),
+            TaggedSchema(name='John Doe', tags=[{'name': 'd'}, ['e']]),
+            TaggedSchema(name='Max Mustermann'),
+        ])
+
+        def distinct(key, query=None):
+            values = TaggedSchema.distinct(key, query)
+            self.assertIsInstance(values, list)
+            return sorted(values, key=lambda value: json.dumps(value, sort_keys=True))
+
+        self.assertEqual(TaggedSchema.count(), 4)
+        self.assertEqual(TaggedSchema.count({'name': 'John Doe'}), 2)
+        self.assertEqual(TaggedSchema.count({'name': {'$in': []}}), 0)
+
+        self.assertEqual(distinct('name'), ['Jane Doe', 'John Doe', 'Max Mustermann'])
+        self.assertEqual(distinct('tags'), ['a', 'b', 'c', ['e'], None, {'name': 'd'}])
+        self.assertEqual(distinct('tags', {'name': 'Jane Doe'}), ['b', 'c', {'name': 'd'}])
+        self.assertEqual(distinct('active'), [False, True])
+        self.assertEqual(distinct('unknown'), [])
+        self.assertEqual(len(distinct('_id', {'name': 'John Doe'})), 2)
+
+        TaggedSchema.drop()
+
+    def test_aggregate(self):
+        class OrderSchema(nosql_schema.Schema):
+            category = fields.StringField()
+            price = fields.NumberField()
+            customer = fields.DictField(required=False)
+
+        OrderSchema.save_all([
+            OrderSchema(category='books', price=10, customer={'country': 'DE'}),
+            OrderSchema(category='books', price=20, customer={'country': 'FR'}),
+            OrderSchema(category='games', price=60, customer={'country': 'DE'}),
+            OrderSchema(category='music', price=5),
+        ])
+
+        rows = OrderSchema.aggregate(group_by='category', sum='price', avg={'average': 'price'}, count=True,
+                                     sort=[('sum_price', -1)], limit=2)
+        self.assertEqual(rows, [{'category': 'games', 'sum_price': 60, 'average': 60.0, 'count': 1},
+                                {'category': 'books', 'sum_price': 30, 'average': 15.0, 'count': 2}])
+
+        rows = OrderSchema.aggregate(match={'price': {'$gte': 10}}, group_by=['customer.country'],
+                                     min='price', max='price', sort='customer.country')
+        self.assertEqual(rows, [{'customer.country': 'DE', 'min_price': 10, 'max_price': 60},
+                                {'customer.country': 'FR', 'min_price': 20, 'max_price': 20}])
+
+        self.assertEqual(OrderSchema.aggregate(sum='price', count='orders'), [{'sum_price': 95, 'orders': 4}])
+        self.assertRaises(ValueError, OrderSchema.aggregate, group_by='category', sort='price')
+
+        # the generic implementation gives the same results
+        with OrderSchema.get_handler() as db:
+            collection = db[OrderSchema.__name__]
+            aggregates = db_query.normalize_aggregates(sum='price', avg='price', count=True)
+            self.assertEqual(nosql_schema.db.AbstractCollectionHandler.aggregate(
+                collection, None, ['category'], aggregates, [('category', 1)]),
+                collection.aggregate(None, ['category'], aggregates, [('category', 1)]))
+
+        # no row without matching documents, on all implementations
+        aggregates = db_query.normalize_aggregates(sum='price', count=True)
+        self.assertEqual(OrderSchema.aggregate(match={'price': {'$gt': 100}}, sum='price', count=True), [])
+        with OrderSchema.get_handler() as db:
+            collection = db[OrderSchema.__name__]
+            self.assertEqual(nosql_schema.db.AbstractCollectionHandler.aggregate(
+                collection, {'price': {'$gt': 100}}, [], aggregates), [])
+
+        # values of different JSON types are different groups
+        OrderSchema.save_all([OrderSchema(category='books', price=1, customer={'vip': True}),
+                              OrderSchema(category='books', price=2, customer={'vip': 1})])
+        rows = OrderSchema.aggregate(match={'customer.vip': {'$exists': True}}, group_by='customer.vip', sum='price')
+        self.assertEqual(sorted((type(row['customer.vip']).__name__, row['sum_price']) for row in rows),
+                         [('bool', 1), ('int', 2)])
+
+        OrderSchema.drop()
+
+    def test_paginate(self):
+        class FeedSchema(nosql_schema.Schema):
+            name = fields.StringField()
+            score = fields.NumberField(required=False)
+
+        FeedSchema.save_all([FeedSchema(name='Item %d' % i, score=[3, 1, 2, None][i % 4]) for i in range(10)])
+
+        def pages(**kwargs):
+            result = []
+            token = None
+            while True:
+                page = FeedSchema.paginate(page_size=3, after=token, **kwargs)
+                result.append([item.name for item in page])
+                if not page.has_next:
+                    return result
+                token = page.next_token
+
+        for kwargs in [{}, {'reverse': True}, {'order_by': 'score'}, {'order_by': 'score', 'reverse': True},
+                       {'order_by': [('score', -1), 'name']}, {'order_by': 'score', 'only': ['name']},
+                       {'order_by': 'score', 'query': {'score': {'$ne': 2}}}, {'order_by': [('name', -1)]}]:
+            names = [item.name for item in FeedSchema.find(kwargs.get('query'), order_by=kwargs.get('order_by', '_id'),
+                                                            reverse=kwargs.get('reverse', False), sort_native=True)]
+            result = pages(**kwargs)
+            self.assertTrue(all(len(page) == 3 for page in result[:-1]))
+            self.assertEqual(sum(result, []), names, kwargs)
+
+        self.assertEqual(len(FeedSchema.paginate(page_size=10)), 10)
+        self.assertIsNone(FeedSchema.paginate(page_size=10).next_token)
+        self.assertRaises(ValueError, FeedSchema.paginate, after='invalid')
+        self.assertRaises(ValueError, FeedSchema.paginate, page_size=0)
+
+        # descending pages are range conditions on indexes too
+        FeedSchema.create_index([('name', -1)])
+        token = FeedSchema.paginate(order_by=[('name', -1)], page_size=3).next_token
+        self.assertEqual(db_query.keyset_query([('name', -1), ('_id', -1)], db_query.decode_token(token, 2), set()),
+                         {'$and': [{'name': {'$lte': 'Item 7'}},
+                                   {'$or': [{'name': {'$lt': 'Item 7'}}, {'name': 'Item 7', '_id': {'$lt': 8}}]}]})
+        with FeedSchema.get_handler() as db:
+            collection = db[FeedSchema.__name__]
+            for sort, values in [([('_id', -1)], [5]), ([('name', -1), ('_id', -1)], ['Item 7', 8])]:
+                where, params = collection._where(db_query.keyset_query(sort, values, set()))
+                plan = str(db.connection.db.execute('explain query plan select id from FeedSchema%s' % where,
+                                                    params).fetchall())
+                self.assertNotIn('SCAN', plan)
+        self.assertRaises(ValueError, FeedSchema.paginate, page_size=-1)
+
+        FeedSchema.drop()
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'asyncio API requires Python 3.5+')
+    def test_aio(self):
+        import asyncio
+        from nosql_schema import aio
+
+        class AsyncUserSchema(aio.AsyncSchema):
+            name = fields.StringField()
+
+        loop = asyncio.new_event_loop()
+        try:
+            obj = AsyncUserSchema(name='John Doe')
+            loop.run_until_complete(obj.asave())
+            self.assertIsNotNone(obj._id)
+
+            loop.run_until_complete(AsyncUserSchema.asave_all([AsyncUserSchema(name='Jane Doe %d' % i)
+                                                                for i in range(5)]))
+            self.assertEqual(loop.run_until_complete(AsyncUserSchema.acount()), 6)
+
+            found = loop.run_until_complete(AsyncUserSchema.afind({'name': 'John Doe'}))
+            self.assertEqual([item._id for item in found], [obj._id])
+            self.assertEqual(loop.run_until_complete(AsyncUserSchema.afind_one({'_id': obj._id})).name, 'John Doe')
+
+            # async for, without the Python 3 only syntax
+            iterator = AsyncUserSchema.aiter_find(order_by='name', batch_size=2)
+            items = []
+            while True:
+                try:
+                    items.append(loop.run_until_complete(iterator.__anext__()))
+                except StopAsyncIteration:
+                    break
+            self.assertEqual([item.name for item in items], ['Jane Doe %d' % i for i in range(5)] + ['John Doe'])
+
+            loop.run_until_complete(obj.adelete())
+            self.assertEqual(AsyncUserSchema.count(), 5)
+        finally:
+            loop.close()
+            aio.shutdown()
+
+        AsyncUserSchema.drop()
+
     def tearDown(self):
+        # close pooled connections
+        nosqlite.close_all()
+
         # remove database
         filename = schema.Schema.__config__['path']
         try:
@@ -175,5 +1014,226 @@ class TestNoSQLSchema(unittest.TestCase):
             pass
 
 
+class StubCursor(object):
+    """
+    pymongo Cursor replacement for StubCollection
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.size = None
+
+    def batch_size(self, size):
+        self.size = size
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class StubResult(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class StubCollection(object):
+    """
+    pymongo Collection replacement, records the calls and returns the given documents / results
+    """
+
+    def __init__(self, documents=None, **results):
+        self.documents = documents or []
+        self.results = results
+        self.calls = []
+        self.cursor = None
+
+    def find(self, **kwargs):
+        self.calls.append(('find', kwargs))
+        self.cursor = StubCursor([dict(document) for document in self.documents])
+        return self.cursor
+
+    def aggregate(self, pipeline):
+        self.calls.append(('aggregate', pipeline))
+        return iter(self.documents)
+
+    def insert_many(self, documents, ordered=True):
+        self.calls.append(('insert_many', ordered))
+        for document in documents:
+            document['_id'] = ObjectId()
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.calls.append((name,) + args + ((kwargs,) if kwargs else ()))
+            return self.results.get(name)
+        return method
+
+
+class StubDatabaseHandler(object):
+    """
+    mongodb DatabaseHandler replacement for a Schema class
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __getitem__(self, collection_name):
+        return mongodb.CollectionHandler(self.collection)
+
+
+class TestMongoDBCollectionHandler(unittest.TestCase):
+    ids = ['5a5e6b4d1d41c80b1c6e1f00', '5a5e6b4d1d41c80b1c6e1f01', '5a5e6b4d1d41c80b1c6e1f02']
+
+    def test_find(self):
+        collection = StubCollection([{'_id': ObjectId(self.ids[0]), 'name': 'John Doe'}])
+        handler = mongodb.CollectionHandler(collection)
+
+        # no sort, skip or limit unless asked for
+        self.assertEqual(handler.find(), [{'_id': self.ids[0], 'name': 'John Doe'}])
+        self.assertEqual(collection.calls[-1], ('find', {'filter': None, 'projection': None, 'sort': None,
+                                                         'skip': 0, 'limit': 0}))
+
+        handler.find({'_id': self.ids[0], 'tags': {'$in': ['a', 'b']}}, limit=5, offset=10,
+                     order_by=['name', ('created', -1)], reverse=True, projection={'name': 1})
+        self.assertEqual(collection.calls[-1], ('find', {
+            'filter': {'_id': ObjectId(self.ids[0]), 'tags': {'$in': ['a', 'b']}}, 'projection': {'name': 1},
+            'sort': [('name', -1), ('created', 1)], 'skip': 10, 'limit': 5}))
+
+        self.assertEqual(list(handler.iter_find({'_id': {'$in': self.ids[:2]}}, batch_size=3)),
+                         [{'_id': self.ids[0], 'name': 'John Doe'}])
+        self.assertEqual(collection.calls[-1][1]['filter'], {'_id': {'$in': [ObjectId(i) for i in self.ids[:2]]}})
+        self.assertEqual(collection.cursor.size, 3)
+
+    def test_writes(self):
+        collection = StubCollection(update_one=StubResult(matched_count=1),
+                                    update_many=StubResult(matched_count=3, modified_count=1),
+                                    delete_many=StubResult(deleted_count=2))
+        handler = mongodb.CollectionHandler(collection)
+
+        self.assertTrue(handler.update_fields(self.ids[0], {'name': 'Jane Doe'}))
+        self.assertEqual(collection.calls[-1], ('update_one', {'_id': ObjectId(self.ids[0])},
+                                                {'$set': {'name': 'Jane Doe'}}))
+
+        # matched documents, like nosqlite
+        self.assertEqual(handler.update_many({'name': 'John Doe'}, {'$inc': {'visits': 1}, '$unset': ['email'],
+                                                                    '$set': {}}), 3)
+        self.assertEqual(collection.calls[-1], ('update_many', {'name': 'John Doe'},
+                                                {'$inc': {'visits': 1}, '$unset': {'email': ''}}))
+
+        self.assertEqual(handler.delete_many({'_id': self.ids[1]}), 2)
+        self.assertEqual(collection.calls[-1], ('delete_many', {'_id': ObjectId(self.ids[1])}))
+
+        documents = [{'name': 'John Doe'}, {'name': 'Jane Doe'}]
+        result = handler.insert_many(documents)
+        self.assertEqual(collection.calls[-1], ('insert_many', False))
+        self.assertEqual(result.ids, [document['_id'] for document in documents])
+        self.assertTrue(all(isinstance(id_, str) for id_ in result.ids))
+
+    def test_distinct_count(self):
+        collection = StubCollection(distinct=[{'name': 'd'}, 'a'], count=2)
+        handler = mongodb.CollectionHandler(collection)
+
+        self.assertEqual(handler.distinct('tags', {'_id': self.ids[0]}), [{'name': 'd'}, 'a'])
+        self.assertEqual(collection.calls[-1], ('distinct', 'tags', {'_id': ObjectId(self.ids[0])}))
+
+        self.assertEqual(handler.count({'name': 'John Doe'}), 2)
+        self.assertEqual(collection.calls[-1], ('count', {'name': 'John Doe'}))
+
+    def test_aggregate(self):
+        collection = StubCollection([{'_id': {'k0': 'books'}, 'a0': 30, 'a1': 2}])
+        handler = mongodb.CollectionHandler(collection)
+        aggregates = db_query.normalize_aggregates(sum='price', count=True)
+
+        rows = handler.aggregate({'_id': {'$ne': self.ids[0]}}, ['category'], aggregates,
+                                 [('sum_price', -1), ('category', 1)], 10)
+        self.assertEqual(rows, [{'category': 'books', 'sum_price': 30, 'count': 2}])
+        self.assertEqual(collection.calls[-1], ('aggregate', [
+            {'$match': {'_id': {'$ne': ObjectId(self.ids[0])}}},
+            {'$group': {'_id': {'k0': '$category'}, 'a0': {'$sum': '$price'}, 'a1': {'$sum': 1}}},
+            {'$sort': SON([('a0', -1), ('_id.k0', 1)])},
+            {'$limit': 10},
+        ]))
+        self.assertEqual(list(collection.calls[-1][1][2]['$sort'].keys()), ['a0', '_id.k0'])
+
+        # without group keys, nothing matched -> no row
+        collection.documents = []
+        self.assertEqual(handler.aggregate(None, [], aggregates), [])
+        self.assertEqual(collection.calls[-1], ('aggregate', [
+            {'$group': {'_id': None, 'a0': {'$sum': '$price'}, 'a1': {'$sum': 1}}}]))
+
+    def test_indexes(self):
+        collection = StubCollection(create_index='name_1', index_information={
+            '_id_': {'key': [('_id', 1)], 'v': 2},
+            'unique_email': {'key': [('email', -1)], 'unique': True, 'v': 2},
+        })
+        handler = mongodb.CollectionHandler(collection)
+
+        self.assertEqual(handler.index_information(), {'_id_': {'keys': [('_id', 1)], 'unique': False},
+                                                       'unique_email': {'keys': [('email', -1)], 'unique': True}})
+        self.assertEqual(sorted(handler.list_indexes()), ['_id_', 'unique_email'])
+
+        self.assertEqual(handler.create_index('name', name='name_1'), 'name_1')
+        self.assertEqual(collection.calls[-1], ('create_index', [('name', 1)], {'name': 'name_1'}))
+
+        # special index types are passed through
+        handler.create_index([('location', '2dsphere'), ('created', 'desc')])
+        self.assertEqual(collection.calls[-1], ('create_index', [('location', '2dsphere'), ('created', -1)]))
+        self.assertEqual(db_query.index_name([('location', '2dsphere'), 'name']), 'location_2dsphere_name_1')
+        self.assertRaises(ValueError, sql.index_statement, 't', 'i', [('location', '2dsphere')])
+
+        # existing special indexes are kept by ensure_indexes
+        class PlaceSchema(schema.Schema):
+            __indexes__ = [[('location', '2dsphere')], [('title', 'text'), ('body', 'text')]]
+            title = fields.StringField()
+
+        collection = StubCollection(index_information={
+            'location_2dsphere': {'key': [('location', '2dsphere')], '2dsphereIndexVersion': 3},
+            'title_text_body_text': {'key': [('_fts', 'text'), ('_ftsx', 1)], 'weights': {'body': 1, 'title': 1}},
+        })
+        PlaceSchema.get_handler = classmethod(lambda cls: StubDatabaseHandler(collection))
+        self.assertEqual(PlaceSchema.ensure_indexes(), [])
+        self.assertEqual([call[0] for call in collection.calls], ['index_information'])
+
+    def test_schema(self):
+        class MongoSchema(schema.Schema):
+            name = fields.StringField()
+            score = fields.NumberField(required=False)
+
+        collection = StubCollection([{'_id': ObjectId(self.ids[i]), 'name': 'John Doe', 'score': i}
+                                     for i in range(3)], bulk_write=StubResult(matched_count=2))
+        MongoSchema.get_handler = classmethod(lambda cls: StubDatabaseHandler(collection))
+
+        # pages are sorted, skipped and limited by the database, the next page continues after the last item
+        page = MongoSchema.paginate({'name': 'John Doe'}, order_by='score', page_size=2, only=['name'])
+        self.assertEqual([item._id for item in page], self.ids[:2])
+        self.assertEqual(collection.calls[-1], ('find', {
+            'filter': {'name': 'John Doe'}, 'projection': {'name': 1, 'score': 1},
+            'sort': [('score', 1), ('_id', 1)], 'skip': 0, 'limit': 3}))
+
+        MongoSchema.paginate({'name': 'John Doe'}, order_by='score', page_size=2, after=page.next_token)
+        self.assertEqual(collection.calls[-1][1]['filter'], {'$and': [{'name': 'John Doe'}, {'$and': [
+            {'score': {'$gte': 1}},
+            {'$or': [{'score': {'$gt': 1}}, {'score': 1, '_id': {'$gt': ObjectId(self.ids[1])}}]}]}]})
+
+        MongoSchema.find(order_by='name', limit=1, offset=2)
+        self.assertEqual(collection.calls[-1], ('find', {'filter': None, 'projection': None,
+                                                         'sort': [('name', 1)], 'skip': 2, 'limit': 1}))
+
+        # loaded objects are updated with one bulk write
+        objects = MongoSchema.find()
+        objects[0].name = 'Jane Doe'
+        objects[2].score = 5
+        del collection.calls[:]
+        self.assertTrue(MongoSchema.save_all(objects).success)
+        self.assertEqual(collection.calls, [('bulk_write', [
+            UpdateOne({'_id': ObjectId(self.ids[0])}, {'$set': {'name': 'Jane Doe'}}),
+            UpdateOne({'_id': ObjectId(self.ids[2])}, {'$set': {'score': 5}})], {'ordered': False})])
+
+
 if __name__ == '__main__':
     unittest.main()